@@ -0,0 +1,21 @@
+import random
+from core import GRASS, SAND, STONE, IRON
+from world import World
+import worldgen
+
+HILL_BLOCKS = [GRASS, SAND, STONE]
+
+def sector_ring(sector, pad=4):
+    x, y, z = sector
+    return [(x + dx, y + dy, z + dz)
+            for dx in range(-pad, pad + 1) for dy in range(-pad, pad + 1) for dz in range(-pad, pad + 1)
+            if dx ** 2 + dy ** 2 + dz ** 2 <= (pad + 1) ** 2]
+
+def generate_world(seed=0, size=120, hills=60):
+    random.seed(seed)
+    world = World([GRASS, IRON] + HILL_BLOCKS)
+    sectors = {}
+    worldgen.generate(world, size, GRASS, IRON, hills, HILL_BLOCKS)
+    for key in world.chunks:
+        sectors.setdefault(key, set()).update(world.chunk_positions(key))
+    return world, sectors
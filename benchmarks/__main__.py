@@ -0,0 +1,438 @@
+from __future__ import print_function, division
+import argparse, glob, json, math, os, platform, random, shutil, subprocess, sys, tempfile, time
+import settings
+import core
+import culling
+from benchmarks.collision import legacy_collide
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def make_model(seed, size, hills):
+    random.seed(seed)
+    return core.Model(size=size, hills=hills)
+
+def bench_generation(seed, size, hills, repeat):
+    times = []
+    for _ in range(repeat):
+        random.seed(seed)
+        start = time.time()
+        model = core.Model(size=size, hills=hills)
+        times.append(time.time() - start)
+        model.close()
+    return {'seconds': min(times), 'blocks': len(model.world)}
+
+def bench_sectors(seed, size, hills, repeat, walk=16):
+    model = make_model(seed, size, hills)
+    start = time.time()
+    model.change_sectors(None, (0, 0, 0))
+    model.process_entire_queue()
+    first = time.time() - start
+    shown = len(model.visible)
+    sector = (0, 0, 0)
+    start = time.time()
+    changes = 0
+    for _ in range(repeat):
+        for dx in list(range(1, walk + 1)) + list(range(walk - 1, -1, -1)):
+            after = (dx, 0, 0)
+            model.change_sectors(sector, after)
+            model.process_entire_queue()
+            sector = after
+            changes += 1
+    elapsed = time.time() - start
+    start = time.time()
+    for sector in list(model.visible):
+        model.show_sector(sector)
+    model.process_entire_queue()
+    show = time.time() - start
+    model.close()
+    return {
+        'first_ring_seconds': first, 'first_ring_sectors': shown,
+        'change_sectors_per_second': changes / elapsed,
+        'show_sector_per_second': shown / show,
+    }
+
+def bench_queries(seed, size, hills, repeat, count=20000):
+    model = make_model(seed, size, hills)
+    rng = random.Random(seed)
+    rays = []
+    for _ in range(count):
+        position = (rng.uniform(-size / 2, size / 2), rng.uniform(-1, 6), rng.uniform(-size / 2, size / 2))
+        yaw, pitch = rng.uniform(0, 2 * math.pi), rng.uniform(-math.pi / 2, math.pi / 2)
+        rays.append((position, (math.cos(yaw) * math.cos(pitch), math.sin(pitch), math.sin(yaw) * math.cos(pitch))))
+    start = time.time()
+    for _ in range(repeat):
+        for position, vector in rays:
+            model.hit_test(position, vector)
+    hit_test = count * repeat / (time.time() - start)
+    start = time.time()
+    for _ in range(repeat):
+        for position, vector in rays:
+            legacy_collide(model.world, position, core.PLAYER_HEIGHT)
+    collide = count * repeat / (time.time() - start)
+    model.close()
+    return {'hit_test_per_second': hit_test, 'collide_per_second': collide}
+
+def bench_physics(seed, size, hills, repeat, bodies=1000, ticks=60):
+    model = make_model(seed, size, hills)
+    rng = random.Random(seed)
+    starts = [(rng.uniform(-size / 2, size / 2), rng.uniform(0, 40), rng.uniform(-size / 2, size / 2),
+               rng.uniform(-5, 5), rng.uniform(-5, 5)) for _ in range(bodies)]
+    dt = 1.0 / core.TICKS_PER_SEC
+    engine = model.physics
+    for x, y, z, vx, vz in starts:
+        body = engine.add(core.physics.Body((x, y, z)))
+        body.vx, body.vz = vx, vz
+    start = time.time()
+    for _ in range(repeat):
+        for _ in range(ticks):
+            engine.update(dt)
+    elapsed = time.time() - start
+    # the old player update: 8 substeps of legacy_collide per tick
+    legacy = [[x, y, z, vx, vz, 0.0] for x, y, z, vx, vz in starts]
+    m = 8
+    start = time.time()
+    for _ in range(repeat):
+        for _ in range(ticks):
+            for state in legacy:
+                for _ in range(m):
+                    state[5] = max(state[5] - dt / m * core.GRAVITY, -core.TERMINAL_VELOCITY)
+                    x, y, z, vx, vz, dy = state
+                    (x, y, z), vertical = legacy_collide(model.world, (x + vx * dt / m, y + dy * dt / m, z + vz * dt / m), core.PLAYER_HEIGHT)
+                    state[:3] = x, y, z
+                    if vertical:
+                        state[5] = 0.0
+    legacy_elapsed = time.time() - start
+    model.close()
+    return {
+        'bodies': bodies,
+        'body_ticks_per_second': bodies * ticks * repeat / elapsed,
+        'legacy_body_ticks_per_second': bodies * ticks * repeat / legacy_elapsed,
+    }
+
+def bench_entities(seed, size, hills, repeat, count=5000, ticks=120):
+    model = make_model(seed, size, hills)
+    rng = random.Random(seed)
+    engine = model.physics
+    dt = 1.0 / core.TICKS_PER_SEC
+    for _ in range(count):
+        model.entities.spawn(core.SAND, (rng.uniform(-size / 2, size / 2), rng.uniform(0, 40), rng.uniform(-size / 2, size / 2)),
+                             (rng.uniform(-5, 5), rng.uniform(0, 5), rng.uniform(-5, 5)))
+    group = model.entities
+    times, steps = [], []
+    for _ in range(ticks):
+        start = time.time()
+        engine.tick(dt)
+        times.append(time.time() - start)
+        steps.append(group.stepped)
+    asleep = sum(1 for flags in group.flags if flags & core.entities.ASLEEP)
+    start = time.time()
+    for _ in range(repeat * ticks):
+        engine.tick(dt)
+    settled = (time.time() - start) / (repeat * ticks)
+    # what each block change costs the group with most entities asleep
+    positions = [(rng.randint(-size // 2, size // 2), rng.randint(-2, 30), rng.randint(-size // 2, size // 2)) for _ in range(1000)]
+    start = time.time()
+    for position in positions:
+        group.wake_near(position)
+    wake = (time.time() - start) / len(positions)
+    model.close()
+    return {
+        'entities': count,
+        'first_tick_ms': times[0] * 1000,
+        'max_tick_ms': max(times) * 1000,
+        'mean_tick_ms': sum(times) / len(times) * 1000,
+        'settled_tick_ms': settled * 1000,
+        'mean_steps_per_tick': sum(steps) / len(steps),
+        'numpy': core.entities.numpy is not None,
+        'wake_near_us': wake * 1e6,
+        'asleep_after_%i_ticks' % ticks: asleep,
+        'tick_budget_ms': dt * 1000,
+    }
+
+def bench_updates(seed, size, hills, repeat, width=20, layers=5):
+    # drops a slab of sand onto the floor by the spawn point, one budgeted tick at a time;
+    # meshing runs inline so worker threads don't show up in the tick times
+    updates_enabled, workers = settings.DO_BLOCK_UPDATES, settings.MESH_WORKERS
+    settings.DO_BLOCK_UPDATES, settings.MESH_WORKERS = True, 0
+    model = make_model(seed, size, hills)
+    model.change_sectors(None, (0, 0, 0))
+    model.process_entire_queue()
+    for y in range(10, 10 + layers):
+        for x in range(-width // 2, width // 2):
+            for z in range(-width // 2, width // 2):
+                model.add_block((x, y, z), core.SAND, immediate=False)
+    times = []
+    while len(model.updates):
+        start = time.time()
+        model.updates.tick()
+        times.append(time.time() - start)
+        model.process_queue()
+    model.process_entire_queue()
+    model.close()
+    settings.DO_BLOCK_UPDATES, settings.MESH_WORKERS = updates_enabled, workers
+    return {
+        'blocks': width * width * layers,
+        'budget': model.updates.budget,
+        'ticks': len(times),
+        'max_tick_ms': max(times) * 1000,
+        'mean_tick_ms': sum(times) / len(times) * 1000,
+    }
+
+def bench_fluids(seed, size, hills, repeat, max_ticks=5000):
+    # pours a water source onto the highest hilltop and lets it run off to the floor
+    workers = settings.MESH_WORKERS
+    settings.MESH_WORKERS = 0
+    model = make_model(seed, size, hills)
+    top = max(model.world, key=lambda position: (position[1], -abs(position[0]) - abs(position[2])))
+    x, y, z = top
+    model.change_sectors(None, core.sectorize(top))
+    model.process_entire_queue()
+    # a generated lake of sources next to it, which should cost nothing to keep
+    for lz in range(-size + 1, -size + 21):
+        model.world.fill_row(-10, 10, -1, lz, core.WATER)
+    model.add_block((x, y + 1, z), core.WATER)
+    times = []
+    cells = 0
+    while len(model.fluids) and len(times) < max_ticks:
+        start = time.time()
+        cells += model.fluids.tick()
+        times.append(time.time() - start)
+        model.process_entire_queue()
+    start = time.time()
+    for _ in range(repeat * 60):
+        model.fluids.tick()
+    idle = (time.time() - start) / (repeat * 60)
+    water = sum(1 for position in model.world if model.world[position] is core.WATER)
+    model.close()
+    settings.MESH_WORKERS = workers
+    return {
+        'hilltop': list(top),
+        'ticks': len(times),
+        'settled': len(times) < max_ticks,
+        'cells_evaluated': cells,
+        'cells_per_second': cells / sum(times),
+        'max_tick_ms': max(times) * 1000,
+        'mean_tick_ms': sum(times) / len(times) * 1000,
+        'idle_tick_ms': idle * 1000,
+        'water_blocks': water,
+    }
+
+def check_occlusion():
+    # a low sector seen from above past a solid slab is hidden; with the slab out of the way it is not
+    eye = (3.3, 10, 3.3)
+    sector = (2, 0, 0)
+    bounds = culling.sector_bounds(sector, -0.5, 0.5)
+    assert culling.occluded(eye, bounds, {(1, 0, 0): (1, 6)}, sector), 'sector behind a solid slab was not culled'
+    assert not culling.occluded(eye, bounds, {(1, -1, 0): (-8, -1)}, sector), 'sector in plain view was culled'
+    # straight down, through a slab in the sector between
+    sector = (0, -2, 0)
+    bounds = culling.sector_bounds(sector, -16.5, -9.5)
+    assert culling.occluded((3.3, 20, 3.3), bounds, {(0, 0, 0): (0, 7)}, sector), 'sector under a solid slab was not culled'
+
+def bench_culling(seed, size, hills, repeat, views=200):
+    # share of the meshed sectors and vertices that would be drawn from random views
+    check_occlusion()
+    model = make_model(seed, size, hills)
+    model.change_sectors(None, (0, 0, 0))
+    model.process_entire_queue()
+    rng = random.Random(seed)
+    cameras = []
+    for _ in range(views):
+        x, z = rng.uniform(-8, 8), rng.uniform(-8, 8)
+        sx, sy, sz = core.sectorize((x, 0, z))
+        y = max([py for sector in model.column_sectors(sx, sz) for px, py, pz in model.sector_positions(sector)] or [0]) + core.PLAYER_HEIGHT
+        cameras.append(((x, y, z), (rng.uniform(0, 360), rng.uniform(-60, 30))))
+    total_sectors = len(model.bounds)
+    total_vertices = sum(model.vertex_counts.values())
+    result = {'sectors': total_sectors, 'vertices': total_vertices}
+    occlusion = settings.OCCLUSION_CULLING
+    for name, enabled in (('frustum', False), ('occlusion', True)):
+        settings.OCCLUSION_CULLING = enabled
+        sectors = vertices = 0
+        start = time.time()
+        for _ in range(repeat):
+            for position, rotation in cameras:
+                drawn = model.cull(position, rotation, 16 / 9)
+                sectors += len(drawn)
+                vertices += sum(model.vertex_counts[sector] for sector in drawn)
+        elapsed = time.time() - start
+        runs = views * repeat
+        result[name] = {
+            'sector_fraction': sectors / runs / total_sectors,
+            'vertex_fraction': vertices / runs / total_vertices,
+            'cull_ms': elapsed / runs * 1000,
+        }
+    settings.OCCLUSION_CULLING = occlusion
+    model.close()
+    return result
+
+def bench_mesh_buffers(seed, size, hills, repeat):
+    from benchmarks import meshing
+    return meshing.allocations(seed, size, hills, repeat=repeat)
+
+def bench_vertex_pool(seed, size, hills, repeat, walk=16):
+    # the buffer pool main.Model draws from, fed by a walk back and forth; without it
+    # every sector upload would make a buffer and every hide or re-upload delete one
+    import buffers
+    random.seed(seed)
+    class PooledModel(core.Model):
+        def _upload_sector(self, sector, meshes, shown):
+            core.Model._upload_sector(self, sector, meshes, shown)
+            meshes = meshes if sector in self.visible else []
+            uploads[0] += sum(1 for mesh in meshes if mesh[1])
+            self.slots.assign(sector, [(mesh[0], len(mesh[1]) // 3) for mesh in meshes if mesh[1]])
+    uploads = [0]
+    pool = buffers.BufferPool(lambda size: None, lambda buffer: None, spare_limit=settings.BUFFER_SPARE_VERTICES)
+    model = PooledModel(size=size, hills=hills)
+    model.slots = buffers.SectorBuffers(pool)
+    sector = (0, 0, 0)
+    model.change_sectors(None, sector)
+    model.process_entire_queue()
+    capacity = []
+    for _ in range(repeat):
+        for dx in list(range(1, walk + 1)) + list(range(walk - 1, -1, -1)):
+            model.change_sectors(sector, (dx, 0, 0))
+            model.process_entire_queue()
+            sector = (dx, 0, 0)
+            pool.compact()
+        capacity.append(pool.capacity)
+    model.close()
+    result = pool.stats()
+    result['uploads'] = uploads[0]
+    result['capacity_per_walk'] = capacity
+    return result
+
+def bench_scheduler(seed, size, hills, repeat, jump=6, draw_ms=8.0):
+    # frames of queued sector work after teleporting back and forth between sectors 2 * jump
+    # apart, with every frame's draw taking draw_ms, nearest first against first in first
+    # out. near_frames is how many frames pass until nothing next to the player's sector
+    # is left queued.
+    from scheduler import clock
+    workers = settings.MESH_WORKERS
+    settings.MESH_WORKERS = 0
+    result = {}
+    for name in ('fifo', 'nearest'):
+        model = make_model(seed, size, hills)
+        if name == 'fifo':
+            model.queue.priority = lambda key: 0
+        queue = model.queue
+        sector = (0, 0, 0)
+        model.change_sectors(None, sector)
+        model.process_entire_queue()
+        near_frames, frames, over = [], 0, []
+        for _ in range(repeat):
+            for dx in (-jump, jump):
+                after = (dx, 0, 0)
+                model.change_sectors(sector, after)
+                sector = after
+                frame = 0
+                near = None
+                while model.busy():
+                    queue.record_draw(draw_ms / 1000)
+                    start = clock()
+                    model.process_queue(start)
+                    over.append(clock() - start - queue.budget)
+                    frame += 1
+                    if near is None and not any(model._distance(entry[2]) <= 1 for entry in queue.heap):
+                        near = frame
+                near_frames.append(near or 0)
+                frames += frame
+        stats = queue.stats()
+        result[name] = {
+            'mean_near_frames': sum(near_frames) / len(near_frames),
+            'frames': frames, 'deferred_frames': stats['deferred_frames'], 'ran': stats['ran'],
+            'budget_ms': stats['budget_ms'], 'max_overrun_ms': max(over) * 1000,
+        }
+        model.close()
+    settings.MESH_WORKERS = workers
+    return result
+
+def bench_saves(seed, size, hills, repeat):
+    import savers_and_loaders
+    backends = sorted(os.path.basename(path)[:-len('_format.py')]
+                      for path in glob.glob(os.path.join(os.path.dirname(savers_and_loaders.__file__), '*_format.py')))
+    model = make_model(seed, size, hills)
+    result = {}
+    cwd = os.getcwd()
+    directory = tempfile.mkdtemp()
+    try:
+        os.chdir(directory)
+        os.mkdir('saves')
+        for backend in backends:
+            module = __import__('savers_and_loaders.%s_format' % backend, fromlist=['save', 'load'])
+            name = 'bench_%s' % backend
+            try:
+                start = time.time()
+                for _ in range(repeat):
+                    module.save(name, world=model.world, position=(0, 0, 0), rotation=(0, 0))
+                saved = (time.time() - start) / repeat
+                start = time.time()
+                for _ in range(repeat):
+                    loaded = module.load(name)
+                    loaded['world'].close()
+                result[backend] = {
+                    'save_seconds': saved,
+                    'load_seconds': (time.time() - start) / repeat,
+                    'bytes': sum(os.path.getsize(path) for path in glob.glob('saves/%s.*' % name)),
+                }
+            except Exception as error:
+                result[backend] = {'error': '%s: %s' % (type(error).__name__, error)}
+            model.world.region = None
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+        model.close()
+    return result
+
+SUITES = {
+    'generation': bench_generation,
+    'sectors': bench_sectors,
+    'queries': bench_queries,
+    'physics': bench_physics,
+    'entities': bench_entities,
+    'updates': bench_updates,
+    'fluids': bench_fluids,
+    'culling': bench_culling,
+    'mesh_buffers': bench_mesh_buffers,
+    'vertex_pool': bench_vertex_pool,
+    'scheduler': bench_scheduler,
+    'saves': bench_saves,
+}
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+        description='Headless benchmarks for world generation, sector meshing, queries and saves.')
+    parser.add_argument('suites', nargs='*', metavar='suite', help='one of %s (default: all)' % ', '.join(sorted(SUITES)))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--size', type=int, default=120)
+    parser.add_argument('--hills', type=int, default=60)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+    for suite in args.suites:
+        if suite not in SUITES:
+            parser.error('unknown suite %r' % suite)
+    settings.LOG_WORLD_GEN_PROGRESS = False
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'seed': args.seed, 'size': args.size, 'hills': args.hills, 'repeat': args.repeat,
+        'results': {},
+    }
+    for suite in args.suites or sorted(SUITES):
+        print('running %s...' % suite, file=sys.stderr)
+        report['results'][suite] = SUITES[suite](args.seed, args.size, args.hills, args.repeat)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+
+if __name__ == '__main__':
+    main()
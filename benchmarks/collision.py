@@ -0,0 +1,27 @@
+from world import FACES, normalize
+
+def legacy_collide(world, position, height):
+    # the 8-substep player collision Window.update used before physics.Physics: returns the
+    # position pushed out of any blocks and whether it hit the floor or ceiling
+    pad = 0.25
+    p = list(position)
+    np = normalize(position)
+    vertical = False
+    for face in FACES:
+        for i in range(3):
+            if not face[i]:
+                continue
+            d = (p[i] - np[i]) * face[i]
+            if d < pad:
+                continue
+            for dy in range(height):
+                op = list(np)
+                op[1] -= dy
+                op[i] += face[i]
+                if tuple(op) not in world:
+                    continue
+                p[i] -= (d - pad) * face[i]
+                if face == (0, -1, 0) or face == (0, 1, 0):
+                    vertical = True
+                break
+    return tuple(p), vertical
@@ -0,0 +1,97 @@
+from __future__ import print_function, division
+import argparse, math, random, time
+from world import normalize
+from benchmarks import generate_world
+
+def legacy_hit_test(world, position, vector, max_distance=8):
+    # the fixed 1/8 block stepping Model.hit_test used before World.raycast
+    m = 8
+    x, y, z = position
+    dx, dy, dz = vector
+    previous = None
+    for _ in range(max_distance * m):
+        key = normalize((x, y, z))
+        if key != previous and key in world:
+            return key, previous
+        previous = key
+        x, y, z = x + dx / m, y + dy / m, z + dz / m
+    return None, None
+
+def exact_hit_test(world, position, vector, max_distance=8):
+    # reference: the nearest block the ray enters within max_distance, found by clipping
+    # the ray against every block around it, so even clipped corners count
+    cells = [range(int(math.floor(min(p, p + d * max_distance) + 0.5)), int(math.floor(max(p, p + d * max_distance) + 0.5)) + 1)
+             for p, d in zip(position, vector)]
+    best = None
+    for x in cells[0]:
+        for y in cells[1]:
+            for z in cells[2]:
+                if (x, y, z) not in world:
+                    continue
+                enter, leave = 0.0, max_distance
+                for p, d, c in zip(position, vector, (x, y, z)):
+                    if d:
+                        t0, t1 = sorted(((c - 0.5 - p) / d, (c + 0.5 - p) / d))
+                        enter, leave = max(enter, t0), min(leave, t1)
+                    elif abs(p - c) > 0.5:
+                        leave = -1
+                if enter <= leave and (best is None or enter < best[0]):
+                    best = enter, (x, y, z)
+    return best and best[1]
+
+def random_rays(count, rng, spread=20):
+    rays = []
+    for _ in range(count):
+        position = (rng.uniform(-spread, spread), rng.uniform(-1, 6), rng.uniform(-spread, spread))
+        yaw, pitch = rng.uniform(0, 2 * math.pi), rng.uniform(-math.pi / 2, math.pi / 2)
+        m = math.cos(pitch)
+        rays.append((position, (math.cos(yaw) * m, math.sin(pitch), math.sin(yaw) * m)))
+    return rays
+
+def run(seed=0, size=60, hills=20, rays=20000, checks=500):
+    world, sectors = generate_world(seed, size, hills)
+    rng = random.Random(seed)
+    sample = random_rays(rays, rng)
+    start = time.time()
+    for position, vector in sample:
+        legacy_hit_test(world, position, vector)
+    legacy_time = time.time() - start
+    start = time.time()
+    for position, vector in sample:
+        world.raycast(position, vector)
+    raycast_time = time.time() - start
+    agree = missed = wrong = 0
+    for position, vector in sample[:checks]:
+        block, previous, face = world.raycast(position, vector)
+        if block == legacy_hit_test(world, position, vector)[0]:
+            agree += 1
+        exact = exact_hit_test(world, position, vector)
+        if exact is not None and block is None:
+            missed += 1
+        elif exact != block:
+            wrong += 1
+    # the old stepping may miss clipped corners, but the traversal must not
+    assert not missed and not wrong, '%i rays missed and %i hit the wrong block' % (missed, wrong)
+    return {
+        'seed': seed, 'rays': rays,
+        'legacy_per_second': rays / legacy_time,
+        'raycast_per_second': rays / raycast_time,
+        'speedup': legacy_time / raycast_time,
+        'checked': checks,
+        'agree_with_legacy': agree,
+        'differ_from_exact': wrong,
+        'missed_vs_exact': missed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Time and check World.raycast against the old stepping hit test.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rays', type=int, default=20000)
+    parser.add_argument('--checks', type=int, default=500)
+    args = parser.parse_args()
+    result = run(args.seed, rays=args.rays, checks=args.checks)
+    for name in sorted(result):
+        print('%s: %s' % (name, result[name]))
+
+if __name__ == '__main__':
+    main()
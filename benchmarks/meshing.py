@@ -0,0 +1,174 @@
+from __future__ import print_function, division
+import argparse, math, time, tracemalloc
+from array import array
+import settings
+from mesher import build_sector, build_sector_greedy, cube_vertices
+from world import FACES, FACE_BITS, sector_origin
+from benchmarks import generate_world, sector_ring
+
+def legacy_build(world, positions):
+    # what _show_block uploaded before: all 24 vertices of every exposed block
+    lists = []
+    for position in positions:
+        if world.exposed(position):
+            x, y, z = position
+            block = world[position]
+            lists.append((cube_vertices(x, y - block.height, z, 0.5), list(block.texture)))
+    return lists
+
+def list_build_sector(world, positions):
+    # build_sector before face templates: a 72-float cube list per block, sliced into
+    # list meshes in world coordinates
+    vertices, textures, colors = [], [], []
+    get_id, palette, face_mask = world.get_id, world.palette, world.face_mask
+    for x, y, z in positions:
+        mask = face_mask(x, y, z)
+        if not mask:
+            continue
+        block = palette[get_id(x, y, z)]
+        cube = cube_vertices(x, y - block.height, z, 0.5)
+        for face in range(len(FACES)):
+            if mask & FACE_BITS[face]:
+                vertices.extend(cube[face * 12:face * 12 + 12])
+                textures.extend(block.texture[face * 8:face * 8 + 8])
+                colors.extend([255] * 12)
+    return vertices, textures, colors
+
+def quad_area(vertices):
+    # total area of the quads in a flat vertex list
+    area = 0.0
+    for q in range(0, len(vertices), 12):
+        x, y, z = vertices[q:q + 3]
+        ux, uy, uz = vertices[q + 3] - x, vertices[q + 4] - y, vertices[q + 5] - z
+        vx, vy, vz = vertices[q + 9] - x, vertices[q + 10] - y, vertices[q + 11] - z
+        area += math.sqrt((uy * vz - uz * vy) ** 2 + (uz * vx - ux * vz) ** 2 + (ux * vy - uy * vx) ** 2)
+    return area
+
+def check_meshes(world, sectors, ring, meshes, greedy):
+    # build_sector must make the same quads, in sector coordinates, as the plain per-face
+    # loop, and greedy meshing must cover exactly the area of those quads
+    for sector, (vertices, textures, colors), tiles in zip(ring, meshes, greedy):
+        ox, oy, oz = sector_origin(sector)
+        lists, list_textures, list_colors = list_build_sector(world, sectors.get(sector, []))
+        local = array('f', [value - (ox, oy, oz)[i % 3] for i, value in enumerate(lists)])
+        assert vertices == local and textures == array('f', list_textures), \
+            'build_sector differs from list_build_sector in sector %r' % (sector,)
+        area = sum(quad_area(tile[0]) for tile in tiles.values())
+        assert abs(area - len(vertices) // 12) < 1e-3, \
+            'greedy quads in sector %r cover %.3f faces, not %i' % (sector, area, len(vertices) // 12)
+
+def allocations(seed=0, size=120, hills=60, pad=4, repeat=3):
+    # throughput and memory of meshing the ring with list_build_sector and build_sector:
+    # peak is the most memory held at once while building, kept what the meshes hold after
+    world, sectors = generate_world(seed, size, hills)
+    ring = [sector for sector in sector_ring((0, 0, 0), pad) if sector in sectors]
+    for sector in ring:
+        world.chunk_faces(sector)
+    blocks = sum(len(sectors[sector]) for sector in ring)
+    result = {'sectors': len(ring), 'blocks': blocks}
+    for name, build in (('lists', lambda sector: list_build_sector(world, sectors[sector])),
+                        ('templates', lambda sector: build_sector(world, sector, sectors[sector]))):
+        build(ring[0])
+        start = time.time()
+        for _ in range(repeat):
+            meshes = [build(sector) for sector in ring]
+        elapsed = (time.time() - start) / repeat
+        meshes = None
+        tracemalloc.start()
+        meshes = [build(sector) for sector in ring]
+        kept, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result[name] = {
+            'blocks_per_second': blocks / elapsed,
+            'peak_bytes': peak,
+            'kept_bytes': kept,
+            'vertices': sum(len(mesh[0]) // 3 for mesh in meshes),
+        }
+    result['speedup'] = result['templates']['blocks_per_second'] / result['lists']['blocks_per_second']
+    return result
+
+def run(seed=0, size=120, hills=60, pad=4, repeat=3, check=True):
+    world, sectors = generate_world(seed, size, hills)
+    ring = sector_ring((0, 0, 0), pad)
+    start = time.time()
+    for _ in range(repeat):
+        legacy = [legacy_build(world, sectors.get(sector, [])) for sector in ring]
+    legacy_time = (time.time() - start) / repeat
+    start = time.time()
+    for _ in range(repeat):
+        meshes = [build_sector(world, sector, sectors.get(sector, [])) for sector in ring]
+    mesh_time = (time.time() - start) / repeat
+    start = time.time()
+    for sector in ring:
+        build_sector(world, sector, sectors.get(sector, []))
+    rebuild_time = (time.time() - start) / len(ring)
+    start = time.time()
+    for _ in range(repeat):
+        greedy = [build_sector_greedy(world, sector, sectors.get(sector, [])) for sector in ring]
+    greedy_time = (time.time() - start) / repeat
+    if check:
+        check_meshes(world, sectors, ring, meshes, greedy)
+    legacy_vertices = sum(len(v) // 3 for lists in legacy for v, t in lists)
+    mesh_vertices = sum(len(v) // 3 for v, t, c in meshes)
+    greedy_vertices = sum(len(v) // 3 for tiles in greedy for v, t, c in tiles.values())
+    return {
+        'seed': seed, 'size': size, 'hills': hills, 'sectors': len(ring),
+        'legacy_vertices': legacy_vertices,
+        'legacy_batch_adds': sum(len(lists) for lists in legacy),
+        'legacy_seconds': legacy_time,
+        'sector_vertices': mesh_vertices,
+        'sector_batch_adds': sum(1 for v, t, c in meshes if v),
+        'sector_seconds': mesh_time,
+        'sector_rebuild_seconds': rebuild_time,
+        'vertex_reduction': legacy_vertices / mesh_vertices,
+        'greedy_vertices': greedy_vertices,
+        'greedy_batch_adds': sum(len(tiles) for tiles in greedy),
+        'greedy_seconds': greedy_time,
+        'greedy_vertex_reduction': legacy_vertices / greedy_vertices,
+    }
+
+def frame_times(seed=0, size=120, hills=60, pad=4, frames=200):
+    # needs a GL context: draws the ring through main.Model with and without greedy meshing
+    import pyglet
+    from pyglet.gl import glFinish
+    import main
+    world, sectors = generate_world(seed, size, hills)
+    window = pyglet.window.Window(visible=False)
+    main.setup()
+    result = {}
+    greedy = settings.GREEDY_MESHING
+    try:
+        for mode in (False, True):
+            settings.GREEDY_MESHING = mode
+            model = main.Model(world)
+            model.change_sectors(None, (0, 0, 0))
+            model.process_entire_queue()
+            window.switch_to()
+            start = time.time()
+            for _ in range(frames):
+                model.draw()
+                glFinish()
+            name = 'greedy' if mode else 'sector'
+            result['%s_frame_seconds' % name] = (time.time() - start) / frames
+    finally:
+        settings.GREEDY_MESHING = greedy
+        window.close()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-block, per-sector culled and greedy meshing.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--size', type=int, default=120)
+    parser.add_argument('--hills', type=int, default=60)
+    parser.add_argument('--pad', type=int, default=4)
+    parser.add_argument('--draw', action='store_true', help='also time drawing both meshes (opens a hidden window)')
+    parser.add_argument('--no-check', dest='check', action='store_false')
+    args = parser.parse_args()
+    result = run(args.seed, args.size, args.hills, args.pad, check=args.check)
+    if args.draw:
+        result.update(frame_times(args.seed, args.size, args.hills, args.pad))
+    for name in sorted(result):
+        print('%s: %s' % (name, result[name]))
+
+if __name__ == '__main__':
+    main()
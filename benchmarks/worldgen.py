@@ -0,0 +1,77 @@
+from __future__ import print_function, division
+import argparse, random, time
+from world import sectorize
+from benchmarks import GRASS as FLOOR, IRON as WALLS, HILL_BLOCKS, generate_world
+
+def legacy_generate(size, hills):
+    # the per-voxel loop Model._initialize used before worldgen, against a dict world
+    world = {}
+    sectors = {}
+    def add_block(position, block):
+        if position in world:
+            sectors[sectorize(position)].remove(position)
+        world[position] = block
+        sectors.setdefault(sectorize(position), []).append(position)
+    n = size
+    y = 0
+    for x in range(-n, n + 1):
+        for z in range(-n, n + 1):
+            add_block((x, y - 2, z), FLOOR)
+            add_block((x, y - 3, z), WALLS)
+            if x in (-n, n) or z in (-n, n):
+                for dy in range(-2, 3):
+                    add_block((x, y + dy, z), WALLS)
+    o = n - 20
+    for _ in range(hills):
+        a = random.randint(-o, o)
+        b = random.randint(-o, o)
+        c = -1
+        h = random.randint(16, 35)
+        s = random.randint(13, 29)
+        t = random.choice(HILL_BLOCKS)
+        for y in range(c, c + h):
+            for x in range(a - s, a + s + 1):
+                for z in range(b - s, b + s + 1):
+                    if (x - a) ** 2 + (z - b) ** 2 > (s + 1) ** 2:
+                        continue
+                    if x ** 2 + z ** 2 < 5 ** 2:
+                        continue
+                    add_block((x, y, z), t)
+            s -= 1
+    return world, sectors
+
+def run(seed=0, size=120, hills=60, check=True):
+    start = time.time()
+    world, sectors = generate_world(seed, size, hills)
+    new_time = time.time() - start
+    random.seed(seed)
+    start = time.time()
+    old_world, old_sectors = legacy_generate(size, hills)
+    old_time = time.time() - start
+    result = {
+        'seed': seed, 'size': size, 'hills': hills, 'blocks': len(world),
+        'legacy_seconds': old_time, 'worldgen_seconds': new_time,
+        'speedup': old_time / new_time,
+    }
+    if check:
+        assert len(world) == len(old_world), '%i blocks, legacy_generate made %i' % (len(world), len(old_world))
+        wrong = sum(1 for position, block in old_world.items() if world.get(position) is not block)
+        assert not wrong, '%i blocks differ from legacy_generate' % wrong
+        assert dict((k, set(v)) for k, v in sectors.items()) == dict((k, set(v)) for k, v in old_sectors.items() if v), \
+            'sector indexes differ from legacy_generate'
+        result['identical'] = True
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Time worldgen against the old per-voxel generation loop.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--size', type=int, default=120)
+    parser.add_argument('--hills', type=int, default=60)
+    parser.add_argument('--no-check', dest='check', action='store_false')
+    args = parser.parse_args()
+    result = run(args.seed, args.size, args.hills, args.check)
+    for name in sorted(result):
+        print('%s: %s' % (name, result[name]))
+
+if __name__ == '__main__':
+    main()
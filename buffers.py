@@ -0,0 +1,123 @@
+class Slot(object):
+    # a vertex buffer from a BufferPool: room for size vertices, count of them in use
+    __slots__ = ('size', 'buffer', 'count')
+
+    def __init__(self, size, buffer):
+        self.size = size
+        self.buffer = buffer
+        self.count = 0
+
+class BufferPool(object):
+    # vertex buffers handed out in slots of fixed sizes (powers of two vertices), so a
+    # sector that is hidden gives its slot back for the next sector of about the same
+    # size instead of its buffer being freed and a new one made. Buffers are made and
+    # freed by the create(size) and destroy(buffer) callbacks; compact() frees spare
+    # slots beyond spare_limit vertices.
+    def __init__(self, create, destroy, min_size=64, spare_limit=1 << 18):
+        self.create = create
+        self.destroy = destroy
+        self.min_size = min_size
+        self.spare_limit = spare_limit
+        self.free = {}
+        self.capacity = 0
+        self.spare = 0
+        self.in_use = 0
+        self.created = 0
+        self.reused = 0
+        self.destroyed = 0
+        self.compactions = 0
+
+    def size_for(self, count):
+        size = self.min_size
+        while size < count:
+            size <<= 1
+        return size
+
+    def fits(self, slot, count):
+        # whether count vertices can stay in slot, i.e. it is still the size acquire would pick
+        return count <= slot.size and (slot.size == self.min_size or count > slot.size // 2)
+
+    def acquire(self, count):
+        size = self.size_for(count)
+        free = self.free.get(size)
+        if free:
+            slot = free.pop()
+            self.spare -= size
+            self.reused += 1
+        else:
+            slot = Slot(size, self.create(size))
+            self.capacity += size
+            self.created += 1
+        slot.count = count
+        self.in_use += count
+        return slot
+
+    def resize(self, slot, count):
+        self.in_use += count - slot.count
+        slot.count = count
+
+    def release(self, slot):
+        self.in_use -= slot.count
+        slot.count = 0
+        self.free.setdefault(slot.size, []).append(slot)
+        self.spare += slot.size
+
+    def compact(self):
+        # frees spare slots, largest first, until no more than spare_limit vertices are spare
+        freed = 0
+        for size in sorted(self.free, reverse=True):
+            slots = self.free[size]
+            while slots and self.spare > self.spare_limit:
+                self.destroy(slots.pop().buffer)
+                self.spare -= size
+                self.capacity -= size
+                self.destroyed += 1
+                freed += 1
+        if freed:
+            self.compactions += 1
+        return freed
+
+    def clear(self):
+        self.spare_limit, limit = 0, self.spare_limit
+        self.compact()
+        self.spare_limit = limit
+
+    def stats(self):
+        return {
+            'capacity_vertices': self.capacity, 'used_vertices': self.in_use,
+            'spare_vertices': self.spare, 'slots': self.created - self.destroyed,
+            'spare_slots': sum(len(slots) for slots in self.free.values()),
+            'created': self.created, 'reused': self.reused, 'destroyed': self.destroyed,
+            'compactions': self.compactions,
+        }
+
+class SectorBuffers(object):
+    # the pool slots holding each sector's meshes. assign() keeps a sector's slots while
+    # its new meshes still fit them and swaps them for better sized ones otherwise.
+    def __init__(self, pool):
+        self.pool = pool
+        self.sectors = {}
+
+    def assign(self, sector, meshes):
+        # meshes are (key, vertex count) pairs, key telling apart the meshes of a sector;
+        # returns (key, slot) for each
+        pool = self.pool
+        old = self.sectors.pop(sector, [])
+        result = []
+        for key, count in meshes:
+            for i, (old_key, slot) in enumerate(old):
+                if old_key == key and pool.fits(slot, count):
+                    del old[i]
+                    pool.resize(slot, count)
+                    break
+            else:
+                slot = pool.acquire(count)
+            result.append((key, slot))
+        for key, slot in old:
+            pool.release(slot)
+        if result:
+            self.sectors[sector] = result
+        return result
+
+    def get(self, sector):
+        return self.sectors.get(sector, ())
@@ -0,0 +1,535 @@
+from __future__ import print_function, division
+import os
+import math, random
+from collections import OrderedDict
+import settings
+import worldgen
+import mesher
+import physics
+import entities
+import updates
+import fluids
+import light
+import culling
+import scheduler
+from mesher import tex_coords, texture_tiles
+from world import World, BLOCK_TYPES, BLOCK_IDS, block_type, SECTOR_SIZE, CHUNK_BITS, CHUNK_SIZE, FACES, sectorize
+
+# the game without pyglet: blocks, the world model and player physics.
+# main.py draws it; servers, tools and benchmarks can use it directly.
+
+TICKS_PER_SEC = 60
+WALKING_SPEED = 5
+RUNNING_SPEED = 9
+FLYING_SPEED = 15
+FLY_RUNNING_SPEED = 21
+GRAVITY = 20.0
+MAX_JUMP_HEIGHT = 1.125
+JUMP_SPEED = math.sqrt(2 * GRAVITY * MAX_JUMP_HEIGHT)
+TERMINAL_VELOCITY = 50
+PLAYER_HEIGHT = 2
+FOCUS_DISTANCE = 8
+FIELD_OF_VIEW = 65.0
+NEAR_PLANE = 0.1
+SOUNDS_PATH = 'sounds'
+
+xrange = range
+_sound_files = []
+def sound_files():
+    if not _sound_files:
+        _sound_files.extend(sorted(os.listdir(SOUNDS_PATH)))
+    return _sound_files
+
+# loaded break sounds by block ID, since blocks can't hold on to them
+_block_sounds = {}
+
+class Block(object):
+    # one shared, immutable definition per block type, with a small integer ID that is
+    # stable as long as blocks are defined in the same order. faces and tiles are the
+    # texture coordinates and atlas tile of each of FACES. Blocks pickle as their name.
+    __slots__ = ('id', 'name', 'texture', 'faces', 'tiles', 'height', 'light', 'break_sfx')
+
+    def __init__(self, texture, name, height=0, break_sfx=None, light=0):
+        if name in BLOCK_TYPES:
+            raise ValueError('Block %s is already defined' % name)
+        texture = tuple(texture)
+        for attr, value in (('id', len(BLOCK_IDS)), ('name', name), ('texture', texture),
+                            ('faces', tuple(texture[face * 8:face * 8 + 8] for face in range(len(FACES)))),
+                            ('tiles', texture_tiles(texture)), ('height', height), ('light', light),
+                            ('break_sfx', None if break_sfx is None else tuple(break_sfx))):
+            object.__setattr__(self, attr, value)
+        BLOCK_TYPES[name] = self
+        BLOCK_IDS.append(self)
+
+    def __setattr__(self, attr, value):
+        raise AttributeError('Block %s is immutable' % self.name)
+
+    __delattr__ = __setattr__
+
+    def __reduce__(self):
+        return (block_type, (self.name,))
+
+    def __repr__(self):
+        return 'Block(%s)' % self.name
+
+    def half(self):
+        # the half-height version, sharing this block's textures
+        return Block(self.texture, self.name + '_HALF', height=0.5, break_sfx=self.break_sfx, light=self.light)
+
+    def sounds(self):
+        # break sounds are found and loaded the first time one is played
+        if not settings.DO_BREAK_SFX:
+            return []
+        sounds = _block_sounds.get(self.id)
+        if sounds is None:
+            from pyglet import media
+            files = self.break_sfx
+            if files is None:
+                prefix = '%s_break' % self.name.lower()
+                files = ['%s/%s' % (SOUNDS_PATH, file) for file in sound_files() if file.startswith(prefix)]
+            sounds = _block_sounds[self.id] = [media.load(sound) for sound in files]
+        return sounds
+
+    def destroy(self, world, x, y, z):
+        from pyglet import media
+        try:
+            sounds = self.sounds()
+            if sounds:
+                random.choice(sounds).play()
+        except media.exceptions.MediaException: pass
+
+GRASS = Block(tex_coords((1, 0), (1, 0), (1, 0)), 'GRASS')
+DIRT = Block(tex_coords((0, 1), (0, 1), (0, 1)), 'DIRT')
+SAND = Block(tex_coords((1, 1), (1, 1), (1, 1)), 'SAND')
+STONE = Block(tex_coords((2, 0), (2, 0), (2, 0)), 'STONE')
+IRON = Block(tex_coords((2, 1), (2, 1), (2, 1)), 'IRON')
+STEEL = Block(tex_coords((3, 1), (3, 1), (3, 1)), 'STEEL')
+WOOD = Block(tex_coords((0, 0), (0, 0), (0, 0)), 'WOOD')
+LOG = Block(tex_coords((3, 0), (3, 0), (3, 3)), 'LOG')
+BENCH = Block(tex_coords((0, 2), (0, 0), (0, 0)), 'BENCH')
+OVEN = Block(tex_coords((3, 2), (3, 2), (1, 2)), 'OVEN')
+REACTOR = Block(tex_coords((2, 2), (2, 2), (2, 2)), 'REACTOR', light=12)
+BLACK_IRON = Block(tex_coords((3, 2), (3, 2), (3, 2)), 'BLACK_IRON')
+FIRE = Block(tex_coords((0, 4), (0, 4), (0, 3)), 'FIRE', light=14)
+ICE = Block(tex_coords((1, 3), (1, 3), (1, 3)), 'ICE')
+WATER = Block(tex_coords((2, 3), (2, 3), (2, 3)), 'WATER')
+BLOCKS = [GRASS, DIRT, SAND, STONE, IRON, STEEL, WOOD, LOG, BENCH, OVEN, REACTOR, BLACK_IRON, FIRE, ICE, WATER]
+HALFBLOCKS = [block.half() for block in BLOCKS]
+
+class Model(object):
+    # the world and which of its blocks are shown; meshes are built but not drawn,
+    # main.Model uploads them to pyglet
+    def __init__(self, world=None, **generation):
+        if world is None and settings.INFINITE_WORLD:
+            generator = worldgen.SectorGenerator(random.getrandbits(32), GRASS, IRON, [GRASS, SAND, STONE])
+            world = worldgen.InfiniteWorld(generator, capacity=settings.SECTOR_CACHE_SIZE)
+        elif world is None:
+            world = World(BLOCKS + HALFBLOCKS)
+        elif not isinstance(world, World):
+            store = World(BLOCKS + HALFBLOCKS)
+            store.update(world)
+            world = store
+        self.world = world
+        self.shown = {}
+        self.visible = set()
+        # per meshed sector: box around its shown blocks, vertex count and solid layers
+        self.bounds = {}
+        self.vertex_counts = {}
+        self.solids = {}
+        self.versions = {}
+        # (x, z) -> the ys of the sectors with blocks in a column; which blocks are in a
+        # sector comes from its chunk, since sectors and chunks are the same cubes
+        self.columns = {}
+        # visible sectors past lod_distance are drawn from coarse meshes, cached until
+        # a block in them changes; the least recently used go once the cache outgrows
+        # lod_cache_size
+        self.view_distance = settings.VIEW_DISTANCE
+        self.lod_distance = settings.LOD_DISTANCE
+        self.center = None
+        self.lod = set()
+        self.lod_meshes = OrderedDict()
+        self.queue = scheduler.FrameScheduler(self._priority, 1.0 / TICKS_PER_SEC, settings.MIN_QUEUE_TIME)
+        self.listeners = [self._forget_lod]
+        self.physics = physics.Physics(self.world, GRAVITY, TERMINAL_VELOCITY, 1.0 / TICKS_PER_SEC)
+        self.entities = entities.Entities(self.physics)
+        self.listeners.append(self.entities.wake_near)
+        self.updates = updates.BlockUpdates(self, settings.BLOCK_UPDATES_PER_TICK, settings.BLOCK_UPDATE_TIME)
+        self.fluids = fluids.Fluids(self, WATER, settings.FLUID_CELLS_PER_TICK, settings.FLUID_UPDATE_TIME)
+        self.light = None
+        if settings.DO_LIGHTING:
+            self.light = light.Light(self)
+        self.workers = None
+        if settings.MESH_WORKERS:
+            self.workers = mesher.MeshWorkers(self.world, settings.MESH_WORKERS, self.light)
+        if not world:
+            self._initialize(**generation)
+        else:
+            self._index_sectors()
+
+    def close(self):
+        if self.workers is not None:
+            self.workers.stop()
+        self.world.close()
+
+    def _initialize(self, size=120, floor=GRASS, walls=IRON, hills=random.randint(40, 80), hillBlocks=[GRASS,SAND,STONE]):
+        length = 2 * size + 1 + hills
+        progress = [0]
+        def update_progress():
+            progress[0] += 1
+            if settings.LOG_WORLD_GEN_PROGRESS:
+                print('Generating World... Progress: %i/%i (%i%%)' % (progress[0], length, progress[0] / length * 100), end='\r')
+        worldgen.generate(self.world, size, floor, walls, hills, hillBlocks, update_progress)
+        self._index_sectors()
+        if settings.LOG_WORLD_GEN_PROGRESS:
+            print()
+
+    def _index_sectors(self, keys=None):
+        for sector in (self.world.chunks if keys is None else keys):
+            self._index_sector(sector)
+            self.lod_meshes.pop(sector, None)
+
+    def _index_sector(self, sector):
+        x, y, z = sector
+        self.columns.setdefault((x, z), set()).add(y)
+
+    def sector_positions(self, sector):
+        return self.world.chunk_positions(sector)
+
+    def column_sectors(self, x, z):
+        return [(x, y, z) for y in self.columns.get((x, z), ())]
+
+    def load_sector(self, sector):
+        x, y, z = sector
+        keys = self.world.fault(x, z)
+        self._index_sectors(keys)
+        if keys and self.light is not None:
+            self.light.forget(sector)
+
+    def unload_sectors(self, center, pad):
+        x, y, z = center
+        keep = set((x + dx, z + dz) for dx in xrange(-pad, pad + 1) for dz in xrange(-pad, pad + 1))
+        evicted = set(self.world.evict(keep))
+        for cx, cz in evicted:
+            for sector in self.column_sectors(cx, cz):
+                self.lod_meshes.pop(sector, None)
+            self.columns.pop((cx, cz), None)
+            if self.light is not None:
+                self.light.forget((cx, 0, cz))
+        if evicted:
+            # mesh versions of sectors in them, air ones included, are not needed again
+            for sector in [sector for sector in self.versions if (sector[0], sector[2]) in evicted]:
+                del self.versions[sector]
+
+    def tick(self):
+        self.updates.tick()
+        self.fluids.tick()
+        if self.light is not None:
+            for sector in self.light.flush():
+                if sector in self.visible:
+                    self.update_sector(sector, False)
+
+    def hit_test(self, position, vector, max_distance=FOCUS_DISTANCE):
+        return self.world.raycast(position, vector, max_distance)
+
+    def exposed(self, position):
+        return self.world.exposed(position)
+
+    def add_block(self, position, texture, immediate=True):
+        self.load_sector(sectorize(position))
+        if position in self.world:
+            self.remove_block(position, immediate)
+        self.world[position] = texture
+        self._index_sector(sectorize(position))
+        self.notify(position)
+        if immediate:
+            if self.exposed(position):
+                self.show_block(position)
+            self.check_neighbors(position)
+            self.update_sectors(position)
+
+    def remove_block(self, position, immediate=True):
+        # if immediate:
+        #     self.world[position].destroy(self.world, *position)
+        del self.world[position]
+        self.notify(position)
+        if immediate:
+            if position in self.shown:
+                self.hide_block(position)
+            self.check_neighbors(position)
+            self.update_sectors(position)
+
+    def _forget_lod(self, position):
+        self.lod_meshes.pop(sectorize(position), None)
+
+    def notify(self, position):
+        for listener in self.listeners:
+            listener(position)
+
+    def check_neighbors(self, position):
+        x, y, z = position
+        for dx, dy, dz in FACES:
+            key = (x + dx, y + dy, z + dz)
+            if key not in self.world:
+                continue
+            if self.exposed(key):
+                if key not in self.shown:
+                    self.show_block(key)
+            else:
+                if key in self.shown:
+                    self.hide_block(key)
+
+    def update_blocks(self, positions):
+        # brings shown in line with blocks changed with immediate=False and queues
+        # every sector they touch for one rebuild
+        sectors = set()
+        for position in positions:
+            if position in self.world and self.exposed(position):
+                if position not in self.shown:
+                    self.show_block(position)
+            elif position in self.shown:
+                self.hide_block(position)
+            self.check_neighbors(position)
+            x, y, z = position
+            sectors.add(sectorize(position))
+            for dx, dy, dz in FACES:
+                sectors.add(sectorize((x + dx, y + dy, z + dz)))
+        for sector in sectors:
+            if sector in self.visible:
+                self.update_sector(sector, False)
+
+    def show_block(self, position):
+        self.shown[position] = self.world[position].texture
+
+    def hide_block(self, position):
+        self.shown.pop(position)
+
+    def update_sectors(self, position):
+        x, y, z = position
+        sectors = set([sectorize(position)])
+        for dx, dy, dz in FACES:
+            sectors.add(sectorize((x + dx, y + dy, z + dz)))
+        for sector in sectors:
+            if sector in self.visible:
+                self.update_sector(sector)
+
+    def update_sector(self, sector, immediate=True):
+        version = self.versions[sector] = self.versions.get(sector, 0) + 1
+        if sector not in self.lod:
+            # face masks are only built on this thread; sectors and chunks are the same cubes
+            self.world.chunk_faces(sector)
+        if self.light is not None and sector in self.visible and sector not in self.lod:
+            self._light_sector(sector)
+        if immediate:
+            self._update_sector(sector)
+        elif self.workers is not None and sector in self.visible and sector not in self.lod:
+            self.workers.submit(sector, version, self.sector_positions(sector), settings.GREEDY_MESHING,
+                                self._distance(sector))
+        else:
+            self.queue.push(sector, self._process_sector, sector, version)
+
+    def _light_sector(self, sector):
+        # light and heightmaps from the sides have to be in before the sector is meshed,
+        # and are only worked out on this thread
+        x, y, z = sector
+        for dx, dy, dz in FACES:
+            if not dy:
+                self.light.ensure((x + dx, y, z + dz))
+        self.light.ensure(sector)
+
+    def _process_sector(self, sector, version):
+        if self.versions.get(sector) == version:
+            self._update_sector(sector)
+
+    def _update_sector(self, sector):
+        shown = {}
+        meshes = []
+        if sector in self.lod:
+            meshes = self.lod_meshes.pop(sector, None)
+            if meshes is None:
+                meshes = mesher.build_lod(self.world, sector)
+            self.lod_meshes[sector] = meshes
+            self._trim_lod()
+        elif sector in self.visible:
+            if self.light is not None:
+                self._light_sector(sector)
+            meshes = mesher.build(self.world, sector, self.sector_positions(sector), settings.GREEDY_MESHING, shown, self.light)
+        self._upload_sector(sector, meshes, shown)
+
+    def _upload_sector(self, sector, meshes, shown):
+        # solid layers are kept for sectors with nothing to draw too: buried ones hide the most
+        solid = self._solid_layers(sector) if sector in self.visible else None
+        if solid is None:
+            self.solids.pop(sector, None)
+        else:
+            self.solids[sector] = solid
+        if sector in self.visible:
+            self.shown.update(shown)
+        meshes = [mesh for mesh in meshes if mesh[1]]
+        if sector not in self.visible or not meshes:
+            self.bounds.pop(sector, None)
+            self.vertex_counts.pop(sector, None)
+            return
+        # meshes are relative to the sector's origin
+        oy = sector[1] * SECTOR_SIZE
+        low = oy + min(min(mesh[1][1::3]) for mesh in meshes)
+        high = oy + max(max(mesh[1][1::3]) for mesh in meshes)
+        self.bounds[sector] = culling.sector_bounds(sector, low, high)
+        self.vertex_counts[sector] = sum(len(mesh[1]) // 3 for mesh in meshes)
+
+    def _solid_layers(self, sector):
+        # the longest run of y layers completely filled across the sector, or None;
+        # sectors and chunks are the same cubes
+        chunk = self.world.chunks.get(sector)
+        if chunk is None:
+            return None
+        oy = sector[1] * SECTOR_SIZE
+        layer = SECTOR_SIZE * SECTOR_SIZE
+        best = run = None
+        for y in range(SECTOR_SIZE):
+            if chunk[y * layer:(y + 1) * layer].count(0) == 0:
+                run = (run[0], oy + y) if run else (oy + y, oy + y)
+                if best is None or run[1] - run[0] > best[1] - best[0]:
+                    best = run
+            else:
+                run = None
+        return best
+
+    @property
+    def far_plane(self):
+        # far enough to see the corners of the outermost ring of sectors
+        return (self.view_distance + 1.5) * SECTOR_SIZE * math.sqrt(2)
+
+    def cull(self, position, rotation, aspect, far=None):
+        # meshed sectors that may be seen from position, nearest first
+        frustum = culling.Frustum(position, rotation, FIELD_OF_VIEW, aspect, NEAR_PLANE, far or self.far_plane)
+        sectors = [sector for sector, bounds in self.bounds.items() if frustum.intersects(bounds)]
+        if settings.OCCLUSION_CULLING:
+            sectors = [sector for sector in sectors
+                       if not culling.occluded(position, self.bounds[sector], self.solids, sector)]
+        x, y, z = position
+        size = SECTOR_SIZE
+        sectors.sort(key=lambda sector: (sector[0] * size + size // 2 - x) ** 2 +
+                     (sector[1] * size + size // 2 - y) ** 2 + (sector[2] * size + size // 2 - z) ** 2)
+        return sectors
+
+    def _collect_sector(self, block=False):
+        result = self.workers.collect(block)
+        if result is None:
+            return
+        sector, version, meshes, shown = result
+        if self.versions.get(sector) != version:
+            return
+        if meshes is None:
+            self._update_sector(sector)
+        else:
+            self._upload_sector(sector, meshes, shown)
+
+    def show_sector(self, sector, lod=False):
+        # a coarse mesh only needs the sector itself; a full one reads the sides of its neighbours
+        if lod:
+            if sector in self.visible and sector not in self.lod:
+                self._hide_blocks(sector)
+            self.lod.add(sector)
+        else:
+            self.lod.discard(sector)
+            x, y, z = sector
+            for dx, dy, dz in FACES:
+                if not dy:
+                    self.load_sector((x + dx, y, z + dz))
+        self.load_sector(sector)
+        self.visible.add(sector)
+        # most of a sphere of sectors is open air, with nothing to mesh
+        if sector in self.world.chunks:
+            self.update_sector(sector, False)
+
+    def hide_sector(self, sector):
+        lod = sector in self.lod
+        self.visible.discard(sector)
+        self.lod.discard(sector)
+        if sector in self.versions:
+            # coarse meshes show no blocks
+            if not lod:
+                self._hide_blocks(sector)
+            self.update_sector(sector, False)
+
+    def _hide_blocks(self, sector):
+        for position in self.sector_positions(sector):
+            if position in self.shown:
+                self.hide_block(position)
+
+    def sector_ring(self, center):
+        # sector -> whether it is drawn at a lower level of detail, for every sector in view of center
+        ring = {}
+        pad = self.view_distance
+        x, y, z = center
+        for dx in xrange(-pad, pad + 1):
+            for dy in xrange(-pad, pad + 1):
+                for dz in xrange(-pad, pad + 1):
+                    distance = dx ** 2 + dy ** 2 + dz ** 2
+                    if distance > (pad + 1) ** 2:
+                        continue
+                    ring[(x + dx, y + dy, z + dz)] = distance > (self.lod_distance + 1) ** 2
+        return ring
+
+    def change_sectors(self, before, after):
+        # shows the ring around after, diffed against what is visible now rather than the
+        # ring around before, so a change of view distance goes through here as well
+        self.center = after
+        self.queue.reprioritize()
+        ring = self.sector_ring(after) if after else {}
+        hide = [sector for sector in self.visible if sector not in ring]
+        for sector, lod in ring.items():
+            if sector not in self.visible or (sector in self.lod) != lod:
+                self.show_sector(sector, lod)
+        for sector in hide:
+            self.hide_sector(sector)
+        if hide and after:
+            self.unload_sectors(after, self.view_distance + 2)
+
+    def lod_cache_size(self):
+        # the sectors of a cube LOD_CACHE_PAD past the view distance, so looking back
+        # over ground just walked away from is still a hit
+        return (2 * (self.view_distance + settings.LOD_CACHE_PAD) + 1) ** 3
+
+    def _trim_lod(self):
+        size = self.lod_cache_size()
+        while len(self.lod_meshes) > size:
+            self.lod_meshes.popitem(last=False)
+
+    def set_view_distance(self, distance, lod_distance=None):
+        self.view_distance = max(1, distance)
+        if lod_distance is not None:
+            self.lod_distance = lod_distance
+        self._trim_lod()
+        if self.center is not None:
+            self.change_sectors(self.center, self.center)
+
+    def _distance(self, sector):
+        if self.center is None:
+            return 0
+        x, y, z = sector
+        cx, cy, cz = self.center
+        return (x - cx) ** 2 + (y - cy) ** 2 + (z - cz) ** 2
+
+    def _priority(self, sector):
+        # queued sector work runs nearest first, with sectors that were hidden last
+        return (sector not in self.visible, self._distance(sector))
+
+    def _poll_workers(self):
+        if self.workers is None or self.workers.results.empty():
+            return False
+        self._collect_sector()
+        return True
+
+    def process_queue(self, start=None):
+        # queued work for a frame begun at start (now by default), within what is left of it
+        self.queue.run(start, self._poll_workers)
+
+    def process_entire_queue(self):
+        while self.queue:
+            self.queue.pop()
+        while self.workers is not None and self.workers.in_flight:
+            self._collect_sector(True)
+
+    def busy(self):
+        return bool(self.queue) or (self.workers is not None and self.workers.in_flight > 0)
@@ -0,0 +1,93 @@
+from __future__ import division
+import math
+from world import SECTOR_SIZE
+
+def sight_vectors(rotation):
+    # forward, right and up unit vectors for a (yaw, pitch) rotation in degrees, matching
+    # Window.set_3d and Window.get_sight_vector
+    x, y = rotation
+    yaw, pitch = math.radians(x), math.radians(y)
+    m = math.cos(pitch)
+    forward = (math.sin(yaw) * m, math.sin(pitch), -math.cos(yaw) * m)
+    right = (math.cos(yaw), 0.0, math.sin(yaw))
+    up = (right[1] * forward[2] - right[2] * forward[1],
+          right[2] * forward[0] - right[0] * forward[2],
+          right[0] * forward[1] - right[1] * forward[0])
+    return forward, right, up
+
+class Frustum(object):
+    # the six planes of a gluPerspective view as (normal, offset) pairs with normals
+    # pointing inwards, so a point p is inside when dot(normal, p) + offset >= 0 for all
+    def __init__(self, position, rotation, fov, aspect, near, far):
+        forward, right, up = sight_vectors(rotation)
+        v = math.radians(fov) / 2
+        h = math.atan(math.tan(v) * aspect)
+        normals = []
+        for axis, angle in ((right, h), (up, v)):
+            c, s = math.cos(angle), math.sin(angle)
+            normals.append(tuple(a * c + f * s for a, f in zip(axis, forward)))
+            normals.append(tuple(-a * c + f * s for a, f in zip(axis, forward)))
+        self.planes = [(n, -sum(a * b for a, b in zip(n, position))) for n in normals]
+        depth = sum(a * b for a, b in zip(forward, position))
+        back = tuple(-f for f in forward)
+        self.planes.append((forward, -depth - near))
+        self.planes.append((back, depth + far))
+
+    def intersects(self, bounds):
+        # whether any of the box (x0, y0, z0, x1, y1, z1) may be inside
+        x0, y0, z0, x1, y1, z1 = bounds
+        for (nx, ny, nz), offset in self.planes:
+            if (nx * (x1 if nx > 0 else x0) + ny * (y1 if ny > 0 else y0) +
+                    nz * (z1 if nz > 0 else z0) + offset) < 0:
+                return False
+        return True
+
+def sector_bounds(sector, low, high):
+    # box around a sector meshed between heights low and high
+    x, y, z = sector
+    return (x * SECTOR_SIZE - 0.5, low, z * SECTOR_SIZE - 0.5,
+            (x + 1) * SECTOR_SIZE - 0.5, high, (z + 1) * SECTOR_SIZE - 0.5)
+
+def occluded(eye, bounds, solids, sector):
+    # coarse occlusion against the solid slabs of other sectors: solids maps a sector to
+    # (low, high), a y range that is solid across the whole sector. The box counts as
+    # hidden when the line from the eye to each of its corners crosses some slab.
+    x0, y0, z0, x1, y1, z1 = bounds
+    for corner in ((x0, y0, z0), (x1, y0, z0), (x0, y0, z1), (x1, y0, z1),
+                   (x0, y1, z0), (x1, y1, z0), (x0, y1, z1), (x1, y1, z1)):
+        if not _blocked(eye, corner, solids, sector):
+            return False
+    return True
+
+def _blocked(eye, target, solids, sector):
+    # walks the sectors the segment crosses in order (a 3D grid traversal), checking the
+    # stretch of it inside each against that sector's slab
+    size = SECTOR_SIZE
+    cell, step, bound, delta = [], [], [], []
+    for e, t in zip(eye, target):
+        c = int(math.floor((e + 0.5) / size))
+        d = t - e
+        cell.append(c)
+        step.append(1 if d > 0 else -1)
+        if d:
+            bound.append(((c + (d > 0)) * size - 0.5 - e) / d)
+            delta.append(size / abs(d))
+        else:
+            bound.append(float('inf'))
+            delta.append(float('inf'))
+    ey, dy = eye[1], target[1] - eye[1]
+    t = 0.0
+    while t < 1:
+        axis = 0 if bound[0] <= bound[1] and bound[0] <= bound[2] else (1 if bound[1] <= bound[2] else 2)
+        key = tuple(cell)
+        solid = solids.get(key)
+        if solid is not None and key != sector:
+            low, high = solid
+            ya, yb = ey + dy * t, ey + dy * min(bound[axis], 1)
+            # the slab fills the sector across, so the segment crosses it when their heights overlap
+            if min(ya, yb) < high + 0.5 and max(ya, yb) > low - 0.5:
+                return True
+        cell[axis] += step[axis]
+        t = bound[axis]
+        bound[axis] += delta[axis]
+    return False
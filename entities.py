@@ -0,0 +1,355 @@
+import math
+from array import array
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from physics import EPSILON
+from world import CHUNK_BITS, CHUNK_MASK, CHUNK_VOLUME, EMPTY_CHUNK
+
+GRAVITY = 1
+COLLIDES = 2
+ON_GROUND = 4
+ASLEEP = 8
+
+# horizontal speed kept per step while on the ground, and the speed that counts as stopped
+FRICTION = 0.6
+STOPPED = 1e-3
+# with NumPy, groups at least this big are stepped in one pass over the arrays
+BATCH_MIN = 64
+
+# chunk keys packed into one integer each, for the NumPy pass
+PACK_BITS = 21
+PACK_OFFSET = 1 << (PACK_BITS - 1)
+PACK_MASK = (1 << PACK_BITS) - 1
+
+def pack_keys(cx, cy, cz):
+    return ((cx + PACK_OFFSET) << (2 * PACK_BITS)) | ((cy + PACK_OFFSET) << PACK_BITS) | (cz + PACK_OFFSET)
+
+def unpack_key(key):
+    return ((key >> (2 * PACK_BITS)) - PACK_OFFSET, ((key >> PACK_BITS) & PACK_MASK) - PACK_OFFSET,
+            (key & PACK_MASK) - PACK_OFFSET)
+
+class ChunkTable(object):
+    # the stored chunks around a batch of boxes, given by their corners, gathered into
+    # one NumPy array so the ids of a voxel in each box can be read in one go. wide marks
+    # boxes spanning more than two chunks along an axis, which it can't read for, and
+    # near those with a stored chunk about them.
+    def __init__(self, chunks, x0, y0, z0, x1, y1, z1):
+        np = numpy
+        # the voxels Physics.sweep reads, with the row above for lowered blocks
+        cx0 = np.floor(x0 + 0.5 + EPSILON).astype(np.int64) >> CHUNK_BITS
+        cy0 = np.floor(y0 + 0.5 + EPSILON).astype(np.int64) >> CHUNK_BITS
+        cz0 = np.floor(z0 + 0.5 + EPSILON).astype(np.int64) >> CHUNK_BITS
+        cx1 = (np.ceil(x1 + 0.5 - EPSILON).astype(np.int64) - 1) >> CHUNK_BITS
+        cy1 = np.ceil(y1 + 0.5 - EPSILON).astype(np.int64) >> CHUNK_BITS
+        cz1 = (np.ceil(z1 + 0.5 - EPSILON).astype(np.int64) - 1) >> CHUNK_BITS
+        self.wide = (cx1 - cx0 > 1) | (cy1 - cy0 > 1) | (cz1 - cz0 > 1)
+        self.low = [cx0, cy0, cz0]
+        # the row in blocks of the chunk at each corner of each box, 0 (all air) if not stored
+        keys, inverse = np.unique(np.concatenate([pack_keys(cx, cy, cz) for cx in (cx0, cx1)
+                                                  for cy in (cy0, cy1) for cz in (cz0, cz1)]), return_inverse=True)
+        rows = np.zeros(len(keys), np.int64)
+        stored = [np.frombuffer(EMPTY_CHUNK, np.uint8)]
+        get = chunks.get
+        for i, key in enumerate(keys.tolist()):
+            chunk = get(unpack_key(key))
+            if chunk is not None:
+                rows[i] = len(stored)
+                stored.append(np.frombuffer(chunk, np.uint8))
+        self.blocks = np.concatenate(stored).reshape(-1, CHUNK_VOLUME)
+        self.corners = rows[inverse].reshape(8, -1).T
+        self.near = (self.corners > 0).any(axis=1)
+        self.boxes = np.arange(len(cx0))
+
+    def narrow(self, boxes):
+        # keeps only the boxes at the indices boxes, in that order
+        self.low = [c[boxes] for c in self.low]
+        self.corners = self.corners[boxes]
+        self.boxes = numpy.arange(len(boxes))
+
+    def ids(self, x, y, z):
+        # the block id at a voxel inside each box; voxels outside read as anything
+        cx0, cy0, cz0 = self.low
+        corner = ((((x >> CHUNK_BITS) - cx0) << 2) | (((y >> CHUNK_BITS) - cy0) << 1) | ((z >> CHUNK_BITS) - cz0)) & 7
+        rows = self.corners[self.boxes, corner]
+        return self.blocks[rows, ((y & CHUNK_MASK) << (2 * CHUNK_BITS)) | ((z & CHUNK_MASK) << CHUNK_BITS) | (x & CHUNK_MASK)]
+
+def sweep_boxes(table, heights, axis, delta, lo, hi):
+    # Physics.sweep for arrays of boxes, lo and hi holding an array per axis: how far each
+    # can move along axis, up to delta. Voxels are visited in the same order as there.
+    np = numpy
+    ends_lo, ends_hi = list(lo), list(hi)
+    ends_lo[axis] = lo[axis] + np.minimum(delta, 0)
+    ends_hi[axis] = hi[axis] + np.maximum(delta, 0)
+    i0 = [np.floor(end + 0.5 + EPSILON).astype(np.int64) for end in ends_lo]
+    i1 = [np.ceil(end + 0.5 - EPSILON).astype(np.int64) for end in ends_hi]
+    i1[1] += 1
+    nx, ny, nz = [b - a for a, b in zip(i0, i1)]
+    start, end = lo[axis], hi[axis]
+    by0, by1 = lo[1] + EPSILON, hi[1] - EPSILON
+    for ox in range(int(nx.max())):
+        for oz in range(int(nz.max())):
+            for oy in range(int(ny.max())):
+                voxel = (i0[0] + ox, i0[1] + oy, i0[2] + oz)
+                ids = table.ids(*voxel)
+                solid = (ids != 0) & (ox < nx) & (oy < ny) & (oz < nz)
+                if not solid.any():
+                    continue
+                bottom = voxel[1] - 0.5 - heights[ids]
+                if axis == 1:
+                    near = bottom
+                else:
+                    solid &= (bottom < by1) & (bottom + 1 > by0)
+                    near = voxel[axis] - 0.5
+                rising = delta > 0
+                up = solid & rising & (end - EPSILON <= near) & (near < end + delta)
+                down = solid & ~rising & (start + EPSILON >= near + 1) & (near + 1 > start + delta)
+                delta = np.where(up, near - end, np.where(down, near + 1 - start, delta))
+    return delta
+
+class Entities(object):
+    # mobs and dropped items as parallel arrays, one slot per entity, stepped together by
+    # a Physics after its bodies. Entities that come to rest on the ground fall asleep and
+    # are skipped until something moves them or a block changes next to them. Every awake
+    # entity moves each step. With NumPy the whole group is stepped in one pass over the
+    # arrays, sweeping all boxes near stored chunks together voxel by voxel; without it,
+    # or for a handful of entities, each is swept on its own.
+    def __init__(self, physics):
+        self.physics = physics
+        self.x, self.y, self.z = array('d'), array('d'), array('d')
+        self.vx, self.vy, self.vz = array('d'), array('d'), array('d')
+        self.radius, self.below, self.above = array('d'), array('d'), array('d')
+        self.flags = array('B')
+        self.kinds = []
+        self.ids = []
+        self.slots = {}
+        self.next_id = 0
+        self.stepped = 0
+        # chunk key -> ids of the entities asleep in it, so a block change only looks at those nearby
+        self.sleeping = {}
+        physics.groups.append(self)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def spawn(self, kind, position, velocity=(0, 0, 0), radius=0.25, below=0.25, above=0.25,
+              flags=GRAVITY | COLLIDES):
+        entity = self.next_id
+        self.next_id += 1
+        self.slots[entity] = len(self.ids)
+        self.ids.append(entity)
+        self.kinds.append(kind)
+        x, y, z = position
+        vx, vy, vz = velocity
+        for column, value in ((self.x, x), (self.y, y), (self.z, z), (self.vx, vx), (self.vy, vy), (self.vz, vz),
+                              (self.radius, radius), (self.below, below), (self.above, above)):
+            column.append(value)
+        self.flags.append(flags)
+        if flags & ASLEEP:
+            self._sleep(self.slots[entity])
+        return entity
+
+    def remove(self, entity):
+        # the last entity moves into the freed slot
+        slot = self.slots[entity]
+        if self.flags[slot] & ASLEEP:
+            self._wake(slot)
+        del self.slots[entity]
+        last = len(self.ids) - 1
+        for column in (self.x, self.y, self.z, self.vx, self.vy, self.vz,
+                       self.radius, self.below, self.above, self.flags, self.kinds, self.ids):
+            column[slot] = column[last]
+            column.pop()
+        if slot != last:
+            self.slots[self.ids[slot]] = slot
+
+    def position(self, entity):
+        slot = self.slots[entity]
+        return (self.x[slot], self.y[slot], self.z[slot])
+
+    def push(self, entity, velocity):
+        slot = self.slots[entity]
+        dx, dy, dz = velocity
+        self.vx[slot] += dx
+        self.vy[slot] += dy
+        self.vz[slot] += dz
+        if self.flags[slot] & ASLEEP:
+            self._wake(slot)
+        self.flags[slot] &= ~ON_GROUND
+
+    def _chunk(self, slot):
+        floor = math.floor
+        return (int(floor(self.x[slot] + 0.5)) >> CHUNK_BITS, int(floor(self.y[slot] + 0.5)) >> CHUNK_BITS,
+                int(floor(self.z[slot] + 0.5)) >> CHUNK_BITS)
+
+    def _sleep(self, slot):
+        key = self._chunk(slot)
+        if key in self.sleeping:
+            self.sleeping[key].add(self.ids[slot])
+        else:
+            self.sleeping[key] = set([self.ids[slot]])
+
+    def _wake(self, slot):
+        key = self._chunk(slot)
+        sleepers = self.sleeping[key]
+        sleepers.discard(self.ids[slot])
+        if not sleepers:
+            del self.sleeping[key]
+        self.flags[slot] &= ~ASLEEP
+
+    def wake_near(self, position, distance=2):
+        # only the chunks within distance of position are looked in
+        px, py, pz = position
+        floor = math.floor
+        xs, ys, zs, slots = self.x, self.y, self.z, self.slots
+        cx0, cx1 = int(floor(px - distance + 0.5)) >> CHUNK_BITS, int(floor(px + distance + 0.5)) >> CHUNK_BITS
+        cy0, cy1 = int(floor(py - distance + 0.5)) >> CHUNK_BITS, int(floor(py + distance + 0.5)) >> CHUNK_BITS
+        cz0, cz1 = int(floor(pz - distance + 0.5)) >> CHUNK_BITS, int(floor(pz + distance + 0.5)) >> CHUNK_BITS
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                for cz in range(cz0, cz1 + 1):
+                    sleepers = self.sleeping.get((cx, cy, cz))
+                    if not sleepers:
+                        continue
+                    for entity in list(sleepers):
+                        slot = slots[entity]
+                        if abs(xs[slot] - px) <= distance and abs(ys[slot] - py) <= distance and \
+                                abs(zs[slot] - pz) <= distance:
+                            self._wake(slot)
+
+    def step(self, dt):
+        if numpy is not None and len(self.flags) >= BATCH_MIN:
+            slots = self._move_batch(dt)
+        else:
+            slots = [slot for slot in range(len(self.flags)) if not self.flags[slot] & ASLEEP]
+            self.stepped = len(slots)
+        self._sweep(slots, dt)
+
+    def _move_batch(self, dt):
+        # the NumPy pass: steps every awake entity, with the same sums Physics.sweep and
+        # _sweep do, and returns the slots of any too big for it to leave to _sweep
+        np = numpy
+        flags = np.frombuffer(self.flags, np.uint8)
+        awake = np.flatnonzero((flags & ASLEEP) == 0)
+        self.stepped = len(awake)
+        if not len(awake):
+            return []
+        physics = self.physics
+        columns = [np.frombuffer(column) for column in (self.x, self.y, self.z, self.vx, self.vy, self.vz)]
+        x, y, z, vx, vy, vz = [column[awake] for column in columns]
+        f = flags[awake]
+        falls = (f & GRAVITY) != 0
+        vy[falls] = np.maximum(vy[falls] - dt * physics.gravity, -physics.terminal_velocity)
+        dx, dy, dz = vx * dt, vy * dt, vz * dt
+        r = np.frombuffer(self.radius)[awake]
+        x0, y0, z0 = x - r, y - np.frombuffer(self.below)[awake], z - r
+        x1, y1, z1 = x + r, y + np.frombuffer(self.above)[awake], z + r
+        table = ChunkTable(physics.world.chunks,
+                           x0 + np.minimum(dx, 0), y0 + np.minimum(dy, 0), z0 + np.minimum(dz, 0),
+                           x1 + np.maximum(dx, 0), y1 + np.maximum(dy, 0), z1 + np.maximum(dz, 0))
+        collides = (f & COLLIDES) != 0
+        loose = collides & table.wide
+        # boxes near no stored chunk move freely
+        f &= 0xff ^ ON_GROUND
+        moved = [x + dx, y + dy, z + dz]
+        asleep = []
+        near = np.flatnonzero(collides & table.near & ~table.wide)
+        if len(near):
+            table.narrow(near)
+            lo = [x0[near], y0[near], z0[near]]
+            hi = [x1[near], y1[near], z1[near]]
+            position = [x[near], y[near], z[near]]
+            velocity = [vx[near], vy[near], vz[near]]
+            g = f[near]
+            heights = np.array(physics.heights)
+            for axis, delta in ((1, dy[near]), (0, dx[near]), (2, dz[near])):
+                step = sweep_boxes(table, heights, axis, delta, lo, hi)
+                hit = step != delta
+                if axis == 1:
+                    g[hit & (delta < 0)] |= ON_GROUND
+                velocity[axis][hit] = 0.0
+                position[axis] += step
+                lo[axis] += step
+                hi[axis] += step
+            ground = (g & ON_GROUND) != 0
+            velocity[0][ground] *= FRICTION
+            velocity[2][ground] *= FRICTION
+            stopped = ground & (np.abs(velocity[0]) < STOPPED) & (np.abs(velocity[2]) < STOPPED)
+            velocity[0][stopped] = velocity[2][stopped] = 0.0
+            g[stopped] |= ASLEEP
+            asleep = awake[near[stopped]].tolist()
+            for axis in range(3):
+                moved[axis][near] = position[axis]
+            vx[near], vy[near], vz[near] = velocity
+            f[near] = g
+        done = ~loose
+        slots = awake[done]
+        for column, values in zip(columns, moved + [vx, vy, vz]):
+            column[slots] = values[done]
+        flags[slots] = f[done]
+        for slot in asleep:
+            self._sleep(slot)
+        return awake[loose].tolist()
+
+    def _sweep(self, slots, dt):
+        # steps each of slots on its own, sweeping its box through the world
+        physics = self.physics
+        sweep, clear, lo, hi = physics.sweep, physics.clear, physics.lo, physics.hi
+        fall, terminal = dt * physics.gravity, -physics.terminal_velocity
+        xs, ys, zs = self.x, self.y, self.z
+        vxs, vys, vzs = self.vx, self.vy, self.vz
+        radii, belows, aboves, flags = self.radius, self.below, self.above, self.flags
+        for slot in slots:
+            f = flags[slot]
+            vx, vy, vz = vxs[slot], vys[slot], vzs[slot]
+            if f & GRAVITY:
+                vy -= fall
+                if vy < terminal:
+                    vy = terminal
+            x, y, z = xs[slot], ys[slot], zs[slot]
+            dx, dy, dz = vx * dt, vy * dt, vz * dt
+            r = radii[slot]
+            x0, y0, z0 = x - r, y - belows[slot], z - r
+            x1, y1, z1 = x + r, y + aboves[slot], z + r
+            if not f & COLLIDES or clear(x0 + dx if dx < 0 else x0, y0 + dy if dy < 0 else y0, z0 + dz if dz < 0 else z0,
+                                         x1 + dx if dx > 0 else x1, y1 + dy if dy > 0 else y1, z1 + dz if dz > 0 else z1):
+                xs[slot], ys[slot], zs[slot] = x + dx, y + dy, z + dz
+                vys[slot] = vy
+                flags[slot] = f & ~ON_GROUND
+                continue
+            lo[0], lo[1], lo[2] = x0, y0, z0
+            hi[0], hi[1], hi[2] = x1, y1, z1
+            f &= ~ON_GROUND
+            if dy:
+                moved = sweep(1, dy)
+                if moved != dy:
+                    if dy < 0:
+                        f |= ON_GROUND
+                    vy = 0.0
+                y += moved
+                lo[1] += moved
+                hi[1] += moved
+            if dx:
+                moved = sweep(0, dx)
+                if moved != dx:
+                    vx = 0.0
+                x += moved
+                lo[0] += moved
+                hi[0] += moved
+            if dz:
+                moved = sweep(2, dz)
+                if moved != dz:
+                    vz = 0.0
+                z += moved
+            if f & ON_GROUND:
+                vx *= FRICTION
+                vz *= FRICTION
+                if -STOPPED < vx < STOPPED and -STOPPED < vz < STOPPED:
+                    vx = vz = 0.0
+                    f |= ASLEEP
+            xs[slot], ys[slot], zs[slot] = x, y, z
+            vxs[slot], vys[slot], vzs[slot] = vx, vy, vz
+            flags[slot] = f
+            if f & ASLEEP:
+                self._sleep(slot)
@@ -0,0 +1,132 @@
+from array import array
+from world import EMPTY_CHUNK, chunk_key, chunk_index
+from scheduler import clock
+from updates import VOID_Y, flush_changes
+
+# levels of flowing fluid; a fluid block with no level stored is a source
+SOURCE = 8
+FALLING = 7
+SIDES = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+class Fluids(object):
+    # flowing water as a cellular automaton. Only cells woken by a block change next to
+    # them are evaluated, a bounded number per tick, and they are kept per chunk so
+    # settled water (generated lakes, placed sources) costs nothing until disturbed.
+    # Levels of flowing cells live in one byte array per chunk that has any. A tick also
+    # stops after time_budget seconds, which covers the relighting and waking done for each
+    # change and re-meshing them; changes not re-meshed by then go first next tick.
+    def __init__(self, model, block, budget=256, time_budget=0.004):
+        self.model = model
+        self.world = model.world
+        self.block = block
+        self.budget = budget
+        self.time_budget = time_budget
+        self.levels = {}
+        self.counts = {}
+        self.active = {}
+        self.changed = set()
+        model.listeners.append(self.wake)
+
+    def __len__(self):
+        return sum(len(cells) for cells in self.active.values()) + len(self.changed)
+
+    def level(self, position):
+        if self.world.get(position) is not self.block:
+            return 0
+        x, y, z = position
+        levels = self.levels.get(chunk_key(position))
+        if levels is None:
+            return SOURCE
+        return levels[chunk_index(x, y, z)] or SOURCE
+
+    def set_level(self, position, level):
+        # level 0 or SOURCE clears the stored level
+        key = chunk_key(position)
+        x, y, z = position
+        index = chunk_index(x, y, z)
+        levels = self.levels.get(key)
+        if levels is None:
+            if level in (0, SOURCE):
+                return
+            levels = self.levels[key] = array('B', EMPTY_CHUNK)
+            self.counts[key] = 0
+        old = levels[index]
+        levels[index] = 0 if level == SOURCE else level
+        self.counts[key] += bool(levels[index]) - bool(old)
+        if not self.counts[key]:
+            del self.levels[key], self.counts[key]
+
+    def wake(self, position):
+        if self.world.get(position) is not self.block:
+            self.set_level(position, 0)
+        x, y, z = position
+        for cell in (position, (x, y + 1, z), (x, y - 1, z), (x + 1, y, z), (x - 1, y, z), (x, y, z + 1), (x, y, z - 1)):
+            key = chunk_key(cell)
+            if key in self.active:
+                self.active[key].add(cell)
+            else:
+                self.active[key] = set([cell])
+
+    def tick(self):
+        # cells woken during this tick wait for the next one
+        deadline = clock() + self.time_budget
+        if self.changed:
+            self.changed = flush_changes(self.model, self.changed, deadline)
+            if self.changed:
+                return 0
+        active, self.active = self.active, {}
+        budget = self.budget
+        for key in list(active):
+            cells = active[key]
+            while cells and budget and clock() < deadline:
+                self.evaluate(cells.pop())
+                budget -= 1
+            if not cells:
+                del active[key]
+        for key, cells in active.items():
+            if key in self.active:
+                self.active[key] |= cells
+            else:
+                self.active[key] = cells
+        if self.changed and clock() < deadline:
+            self.changed = flush_changes(self.model, self.changed, deadline)
+        return self.budget - budget
+
+    def change(self, position, level):
+        if level:
+            self.model.add_block(position, self.block, immediate=False)
+        else:
+            self.model.remove_block(position, immediate=False)
+        self.set_level(position, level)
+        self.changed.add(position)
+
+    def evaluate(self, position):
+        world, block = self.world, self.block
+        if world.get(position) is not block:
+            return
+        x, y, z = position
+        level = self.level(position)
+        if level != SOURCE:
+            # flowing water takes its level from what feeds it and dries up without it
+            if world.get((x, y + 1, z)) is block:
+                want = FALLING
+            else:
+                want = 0
+                for dx, dz in SIDES:
+                    want = max(want, self.level((x + dx, y, z + dz)) - 1)
+            if want != level:
+                self.change(position, want)
+                if not want:
+                    return
+                level = want
+        if y <= VOID_Y:
+            self.change(position, 0)
+            return
+        below = world.get((x, y - 1, z))
+        if below is None:
+            self.change((x, y - 1, z), FALLING)
+        elif below is not block and level > 1:
+            for dx, dz in SIDES:
+                side = (x + dx, y, z + dz)
+                if side not in world:
+                    self.change(side, level - 1)
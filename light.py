@@ -0,0 +1,228 @@
+from array import array
+from collections import deque
+from world import CHUNK_BITS, CHUNK_MASK, EMPTY_CHUNK, FACES, chunk_index, sectorize
+
+MAX_LIGHT = 15
+# stored light bytes hold sky light in the high nibble and block light in the low one
+SKY = 4
+BLOCK = 0
+NO_BLOCK = -(1 << 30)
+# vertex colour for each light level
+BRIGHTNESS = [int(255 * max(0.8 ** (MAX_LIGHT - level), 0.08)) for level in range(MAX_LIGHT + 1)]
+
+class Light(object):
+    # sky and block light, flood filled per cell. Everything above the highest block of
+    # a column is open sky (full sky light, never stored); below that, light is kept in one
+    # byte array per chunk. Sector columns are lit the first time they are meshed and
+    # relit incrementally on every block change after that; a column is lit whole, since
+    # sky light reaches down through every sector in it.
+    def __init__(self, model):
+        self.model = model
+        self.world = model.world
+        self.maps = {}
+        self.heights = {}
+        self.lit = set()
+        self.touched = set()
+        model.listeners.append(self.on_change)
+
+    def height(self, x, z):
+        heights = self.column_heights(x >> CHUNK_BITS, z >> CHUNK_BITS)
+        return heights[((z & CHUNK_MASK) << CHUNK_BITS) | (x & CHUNK_MASK)]
+
+    def column_heights(self, cx, cz):
+        # heightmaps are only made on the main thread; mesh workers just read them
+        heights = self.heights.get((cx, cz))
+        if heights is None:
+            heights = self.heights[(cx, cz)] = self._column_heights(cx, cz)
+        return heights
+
+    def _column_heights(self, cx, cz):
+        # straight from the chunk bytes: an index into a chunk is its layer's offset plus
+        # the column's index into heights
+        area = 1 << 2 * CHUNK_BITS
+        heights = array('i', [NO_BLOCK]) * area
+        chunks = self.world.chunks
+        for key in sorted(self.model.column_sectors(cx, cz), key=lambda key: key[1]):
+            chunk = chunks.get(key)
+            if chunk is None:
+                continue
+            base = key[1] << CHUNK_BITS
+            for index, block_id in enumerate(chunk):
+                if block_id:
+                    heights[index & (area - 1)] = base + (index >> 2 * CHUNK_BITS)
+        return heights
+
+    def get(self, x, y, z, shift):
+        if shift == SKY and y > self.height(x, z):
+            return MAX_LIGHT
+        light = self.maps.get((x >> CHUNK_BITS, y >> CHUNK_BITS, z >> CHUNK_BITS))
+        if light is None:
+            return 0
+        return (light[chunk_index(x, y, z)] >> shift) & MAX_LIGHT
+
+    def set(self, x, y, z, shift, level):
+        key = (x >> CHUNK_BITS, y >> CHUNK_BITS, z >> CHUNK_BITS)
+        light = self.maps.get(key)
+        if light is None:
+            if not level:
+                return
+            light = self.maps[key] = array('B', EMPTY_CHUNK)
+        index = chunk_index(x, y, z)
+        light[index] = (light[index] & ~(MAX_LIGHT << shift)) | (level << shift)
+        self.touched.add(key)
+
+    def brightness(self, x, y, z):
+        # called for every face meshed, from worker threads too, so it only reads: the
+        # heightmaps a mesh needs are made by ensure before it is queued, and a column
+        # without one counts as open sky. Open sky is checked first and inline.
+        heights = self.heights.get((x >> CHUNK_BITS, z >> CHUNK_BITS))
+        if heights is None or y > heights[((z & CHUNK_MASK) << CHUNK_BITS) | (x & CHUNK_MASK)]:
+            return BRIGHTNESS[MAX_LIGHT]
+        light = self.maps.get((x >> CHUNK_BITS, y >> CHUNK_BITS, z >> CHUNK_BITS))
+        if light is None:
+            return BRIGHTNESS[0]
+        value = light[chunk_index(x, y, z)]
+        return BRIGHTNESS[max(value >> SKY, value & MAX_LIGHT)]
+
+    def ensure(self, sector):
+        # lights a sector column: emitters in it, and sky light reaching under overhangs.
+        # Its heightmap is made even when it is lit already, since on_change and forget drop them.
+        cx, cy, cz = sector
+        self.column_heights(cx, cz)
+        if (cx, cz) in self.lit:
+            return
+        self.lit.add((cx, cz))
+        world = self.world
+        get_id, palette = world.get_id, world.palette
+        positions = [position for key in self.model.column_sectors(cx, cz) for position in world.chunk_positions(key)]
+        emitters = set(block_id for block_id in range(1, len(palette)) if palette[block_id].light)
+        bottoms = {}
+        counts = {}
+        sky, block = deque(), deque()
+        for x, y, z in positions:
+            if emitters:
+                block_id = get_id(x, y, z)
+                if block_id in emitters:
+                    self.set(x, y, z, BLOCK, palette[block_id].light)
+                    block.append((x, y, z))
+            column = (x, z)
+            counts[column] = counts.get(column, 0) + 1
+            if y < bottoms.get(column, y + 1):
+                bottoms[column] = y
+        for (x, z), bottom in bottoms.items():
+            height = self.height(x, z)
+            if counts[(x, z)] == height - bottom + 1:
+                # solid all the way down, nothing for the sky to reach under
+                continue
+            for y in range(bottom, height):
+                if get_id(x, y, z):
+                    continue
+                for dx, dz in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+                    if y > self.height(x + dx, z + dz):
+                        sky.append((x + dx, y, z + dz))
+        self._spread(sky, SKY)
+        self._spread(block, BLOCK)
+
+    def forget(self, sector):
+        # drops everything known about a sector column whose blocks were loaded or unloaded
+        cx, cy, cz = sector
+        self.lit.discard((cx, cz))
+        self.heights.pop((cx, cz), None)
+        for key in [key for key in self.maps if key[0] == cx and key[2] == cz]:
+            del self.maps[key]
+
+    def flush(self):
+        # sectors whose light changed since the last flush
+        sectors = set(sectorize((cx << CHUNK_BITS, cy << CHUNK_BITS, cz << CHUNK_BITS)) for cx, cy, cz in self.touched)
+        self.touched.clear()
+        return sectors
+
+    def on_change(self, position):
+        x, y, z = position
+        column = (x >> CHUNK_BITS, z >> CHUNK_BITS)
+        if column not in self.lit:
+            self.heights.pop(column, None)
+            return
+        get_id = self.world.get_id
+        height = self.height(x, z)
+        heights = self.heights[column]
+        index = ((z & CHUNK_MASK) << CHUNK_BITS) | (x & CHUNK_MASK)
+        sky, block = deque(), deque()
+        block_id = get_id(x, y, z)
+        if block_id:
+            if y > height:
+                # the column below the new block was open sky; all of it keeps full light
+                # until the removal below walks down it. An empty column goes down to the
+                # bottom of its stored chunks.
+                heights[index] = y
+                if height == NO_BLOCK:
+                    height = min(min(cy for cx, cy, cz in self.model.column_sectors(*column)) << CHUNK_BITS, y) - 1
+                for below in range(height + 1, y):
+                    self.set(x, below, z, SKY, MAX_LIGHT)
+                old = MAX_LIGHT
+            else:
+                old = self.get(x, y, z, SKY)
+            self.set(x, y, z, SKY, 0)
+            self._unspread(deque([(x, y, z, old)]), SKY, sky)
+            old = self.get(x, y, z, BLOCK)
+            self.set(x, y, z, BLOCK, 0)
+            self._unspread(deque([(x, y, z, old)]), BLOCK, block)
+            emission = self.world.palette[block_id].light
+            if emission:
+                self.set(x, y, z, BLOCK, emission)
+                block.append((x, y, z))
+        else:
+            old = self.get(x, y, z, BLOCK)
+            if old:
+                self.set(x, y, z, BLOCK, 0)
+                self._unspread(deque([(x, y, z, old)]), BLOCK, block)
+            if y == height:
+                below = y - 1
+                while below > y - 256 and not get_id(x, below, z):
+                    below -= 1
+                heights[index] = below if below > y - 256 else NO_BLOCK
+                for open_y in range(below + 1, y + 1):
+                    self.set(x, open_y, z, SKY, 0)
+                    sky.append((x, open_y, z))
+            for dx, dy, dz in FACES:
+                sky.append((x + dx, y + dy, z + dz))
+                block.append((x + dx, y + dy, z + dz))
+        self._spread(sky, SKY)
+        self._spread(block, BLOCK)
+
+    def _spread(self, queue, shift):
+        # breadth first from each queued cell into darker open neighbours; sky light at
+        # full strength goes straight down without fading
+        get_id, get, set = self.world.get_id, self.get, self.set
+        while queue:
+            x, y, z = queue.popleft()
+            level = get(x, y, z, shift)
+            if level <= 1:
+                continue
+            for dx, dy, dz in FACES:
+                nx, ny, nz = x + dx, y + dy, z + dz
+                if get_id(nx, ny, nz):
+                    continue
+                new = level if (shift == SKY and level == MAX_LIGHT and dy < 0) else level - 1
+                if get(nx, ny, nz, shift) < new:
+                    set(nx, ny, nz, shift, new)
+                    queue.append((nx, ny, nz))
+
+    def _unspread(self, queue, shift, relight):
+        # clears light that came from a removed source, collecting the cells still lit
+        # from elsewhere in relight so _spread can fill the gap back in
+        get_id, get, set = self.world.get_id, self.get, self.set
+        while queue:
+            x, y, z, old = queue.popleft()
+            for dx, dy, dz in FACES:
+                nx, ny, nz = x + dx, y + dy, z + dz
+                level = get(nx, ny, nz, shift)
+                if not level:
+                    continue
+                if get_id(nx, ny, nz) or (shift == SKY and ny > self.height(nx, nz)):
+                    relight.append((nx, ny, nz))
+                elif level < old or (shift == SKY and old == MAX_LIGHT and level == MAX_LIGHT and dy < 0):
+                    set(nx, ny, nz, shift, 0)
+                    queue.append((nx, ny, nz, level))
+                else:
+                    relight.append((nx, ny, nz))
@@ -1,38 +1,26 @@
 from __future__ import print_function, nested_scopes, division
-import sys, os
-import math, random, time, datetime
-try:
-    import _thread as thread
-except ImportError:
-    import thread
-from collections import deque
+import sys
+import math, random, datetime
+import importlib
 from pyglet import image, options
 from pyglet.gl import *
 from pyglet.graphics import TextureGroup
 from pyglet.window import key, mouse
 options['audio'] = ('openal', 'pulse', 'directsound', 'silent')
-from pyglet import media
 import settings
-
-TICKS_PER_SEC = 60
-SECTOR_SIZE = 8
-WALKING_SPEED = 5
-RUNNING_SPEED = 9
-FLYING_SPEED = 15
-FLY_RUNNING_SPEED = 21
-GRAVITY = 20.0
-MAX_JUMP_HEIGHT = 1.125
-JUMP_SPEED = math.sqrt(2 * GRAVITY * MAX_JUMP_HEIGHT)
-TERMINAL_VELOCITY = 50
-PLAYER_HEIGHT = 2
+import core
+import mesher
+import physics
+import buffers
+from scheduler import clock
+from mesher import cube_vertices
+from core import (TICKS_PER_SEC, WALKING_SPEED, RUNNING_SPEED, FLYING_SPEED, FLY_RUNNING_SPEED,
+                  JUMP_SPEED, FOCUS_DISTANCE, FIELD_OF_VIEW, NEAR_PLANE,
+                  BLOCKS, HALFBLOCKS)
+from world import sectorize, sector_origin
 
 # sys.path.append('savers_and_loaders')
 
-xrange = range
-if hasattr(time, 'process_time'):
-    timefunc = time.process_time
-else:
-    timefunc = time.clock
 if sys.version_info[0] == 2:
     input = raw_input
 
@@ -44,300 +32,107 @@ def lerp(colL, colU, rate):
     b = _lerp(colL[2], colU[2], rate)
     return r, g, b
 
-def cube_vertices(x, y, z, n):
-    return [
-        x-n,y+n,z-n, x-n,y+n,z+n, x+n,y+n,z+n, x+n,y+n,z-n,
-        x-n,y-n,z-n, x+n,y-n,z-n, x+n,y-n,z+n, x-n,y-n,z+n,
-        x-n,y-n,z-n, x-n,y-n,z+n, x-n,y+n,z+n, x-n,y+n,z-n,
-        x+n,y-n,z+n, x+n,y-n,z-n, x+n,y+n,z-n, x+n,y+n,z+n,
-        x-n,y-n,z+n, x+n,y-n,z+n, x+n,y+n,z+n, x-n,y+n,z+n,
-        x+n,y-n,z-n, x-n,y-n,z-n, x-n,y+n,z-n, x+n,y+n,z-n,
-    ]
-
-def tex_coord(x, y, n=8):
-    m = 1.0 / n
-    dx = x * m
-    dy = y * m
-    return dx, dy, dx + m, dy, dx + m, dy + m, dx, dy + m
-
-def tex_coords(top, bottom, side):
-    top = tex_coord(*top)
-    bottom = tex_coord(*bottom)
-    side = tex_coord(*side)
-    result = []
-    result.extend(top)
-    result.extend(bottom)
-    result.extend(side * 4)
-    return result
-
-class Block:
-    def __init__(self, texture, name, height=0, break_sfx=None):
-        self.texture = texture
-        self.name = name
-        self.height = height
-        if break_sfx is None:
-            break_sfx = []
-            for file in os.listdir('sounds'):
-                if file.startswith('%s_break' % name.lower()):
-                    break_sfx.append('sounds/%s' % file)
-                    print(file)
-        if settings.DO_BREAK_SFX:
-            for (num, sound) in enumerate(break_sfx):
-                break_sfx[num] = media.load(sound)
-        else:
-            self.break_sfx = None
-    def notify_update(self, world, x, y, z): 
-        print('Block Update:', str(world)[:25], x, y, z)
-    def block_update(self, world, x, y, z):
-        if not settings.DO_BLOCK_UPDATES: return
-        for (nx, ny, nz) in ((0,0,1), (0,1,0), (1,0,0), (0,0,-1), (0,-1,0), (-1,0,0)):
-            coords = (x + nx), (y + ny), (z + nz)
-            if coords in world:
-                world[coords].notify_update(world, *coords)
-    def destroy(self, world, x, y, z):
-        self.block_update(world, x, y, z)
-        if self.break_sfx is not None:
-            try:
-                print(self.break_sfx)
-                print(random.choice(self.break_sfx))
-                random.choice(self.break_sfx).play()
-            except media.exceptions.MediaException: pass
-
 TEXTURE_PATH = 'textures/texture.png'
-GRASS = Block(tex_coords((1, 0), (1, 0), (1, 0)), 'GRASS')
-DIRT = Block(tex_coords((0, 1), (0, 1), (0, 1)), 'DIRT')
-SAND = Block(tex_coords((1, 1), (1, 1), (1, 1)), 'SAND')
-STONE = Block(tex_coords((2, 0), (2, 0), (2, 0)), 'STONE')
-IRON = Block(tex_coords((2, 1), (2, 1), (2, 1)), 'IRON')
-STEEL = Block(tex_coords((3, 1), (3, 1), (3, 1)), 'STEEL')
-WOOD = Block(tex_coords((0, 0), (0, 0), (0, 0)), 'WOOD')
-LOG = Block(tex_coords((3, 0), (3, 0), (3, 3)), 'LOG')
-BENCH = Block(tex_coords((0, 2), (0, 0), (0, 0)), 'BENCH')
-OVEN = Block(tex_coords((3, 2), (3, 2), (1, 2)), 'OVEN')
-REACTOR = Block(tex_coords((2, 2), (2, 2), (2, 2)), 'REACTOR')
-BLACK_IRON = Block(tex_coords((3, 2), (3, 2), (3, 2)), 'BLACK_IRON')
-FIRE = Block(tex_coords((0, 4), (0, 4), (0, 3)), 'FIRE')
-ICE = Block(tex_coords((1, 3), (1, 3), (1, 3)), 'ICE')
-WATER = Block(tex_coords((2, 3), (2, 3), (2, 3)), 'WATER')
-BLOCKS = [GRASS, DIRT, SAND, STONE, IRON, STEEL, WOOD, LOG, BENCH, OVEN, REACTOR, BLACK_IRON, FIRE, ICE, WATER]
-HALFBLOCKS = []
-for block in BLOCKS:
-    HALFBLOCKS.append(Block(block.texture, block.name+'_HALF', height=0.5))
-FACES = [
-    ( 0, 1, 0),
-    ( 0,-1, 0),
-    (-1, 0, 0),
-    ( 1, 0, 0),
-    ( 0, 0, 1),
-    ( 0, 0,-1),
-]
-
-def normalize(position):
-    x, y, z = position
-    x, y, z = (int(round(x)), int(round(y)), int(round(z)))
-    return (x, y, z)
-
-def sectorize(position):
-    x, y, z = normalize(position)
-    x, y, z = x // SECTOR_SIZE, y // SECTOR_SIZE, z // SECTOR_SIZE
-    return (x, 0, z)
-
-class Model(object):
-    def __init__(self, world=None):
-        self.batch = pyglet.graphics.Batch()
-        self.group = TextureGroup(image.load(TEXTURE_PATH).get_texture())
-        if world is None:
-            world = {}
-        self.world = world
-        self.shown = {}
-        self._shown = {}
-        self.sectors = {}
-        self.queue = deque()
-        if not world:
-            self._initialize()
-
-    def _initialize(self, size=120, floor=GRASS, walls=IRON, hills=random.randint(40, 80), hillBlocks=[GRASS,SAND,STONE]):
-        n = size
-        s = 1
-        y = 0
-        def update_progress(progress, amount=1):
-            progress += amount
-            if settings.LOG_WORLD_GEN_PROGRESS:
-                print('Generating World... Progress: %i/%i (%i%%)' % (progress, length, progress / length * 100), end='\r')
-            return progress
-        length = ((2 * size + 2) ** 2) + hills * 5000 - 483
-        progress = 0
-        for x in xrange(-n, n + 1, s):
-            for z in xrange(-n, n + 1, s):
-                self.add_block((x, y - 2, z), floor, immediate=False)
-                self.add_block((x, y - 3, z), walls, immediate=False)
-                if x in (-n, n) or z in (-n, n):
-                    for dy in xrange(-2, 3):
-                        self.add_block((x, y + dy, z), walls, immediate=False)
-                progress = update_progress(progress)
-        o = n - 20
-        for _ in xrange(hills):
-            a = random.randint(-o, o)
-            b = random.randint(-o, o)
-            c = -1
-            h = random.randint(16, 35)
-            s = random.randint(13, 29)
-            d = 1
-            t = random.choice(hillBlocks)
-            for y in xrange(c, c + h):
-                for x in xrange(a - s, a + s + 1):
-                    for z in xrange(b - s, b + s + 1):
-                        if (x - a) ** 2 + (z - b) ** 2 > (s + 1) ** 2:
-                            continue
-                        if (x - 0) ** 2 + (z - 0) ** 2 < 5 ** 2:
-                            continue
-                        self.add_block((x, y, z), t, immediate=False)
-                s -= d
-            progress = update_progress(progress, 5000)
-        print()
-
-    def hit_test(self, position, vector, max_distance=8):
-        m = 8
-        x, y, z = position
-        dx, dy, dz = vector
-        previous = None
-        for _ in xrange(max_distance * m):
-            key = normalize((x, y, z))
-            if key != previous and key in self.world:
-                return key, previous
-            previous = key
-            x, y, z = x + dx / m, y + dy / m, z + dz / m
-        return None, None
-
-    def exposed(self, position):
-        x, y, z = position
-        for dx, dy, dz in FACES:
-            if (x + dx, y + dy, z + dz) not in self.world:
-                return True
-        return False
-
-    def add_block(self, position, texture, immediate=True):
-        if position in self.world:
-            self.remove_block(position, immediate)
-        self.world[position] = texture
-        self.sectors.setdefault(sectorize(position), []).append(position)
-        if immediate:
-            if self.exposed(position):
-                self.show_block(position)
-            self.check_neighbors(position)
-
-    def remove_block(self, position, immediate=True):
-        # if immediate:
-        #     self.world[position].destroy(self.world, *position)
-        del self.world[position]
-        self.sectors[sectorize(position)].remove(position)
-        if immediate:
-            if position in self.shown:
-                self.hide_block(position)
-            self.check_neighbors(position)
-
-    def check_neighbors(self, position):
-        x, y, z = position
-        for dx, dy, dz in FACES:
-            key = (x + dx, y + dy, z + dz)
-            if key not in self.world:
-                continue
-            if self.exposed(key):
-                if key not in self.shown:
-                    self.show_block(key)
-            else:
-                if key in self.shown:
-                    self.hide_block(key)
-
-    def show_block(self, position, immediate=True):
-        texture = self.world[position].texture
-        self.shown[position] = texture
-        if immediate:
-            self._show_block(position, texture)
-        else:
-            self._enqueue(self._show_block, position, texture)
 
-    def _show_block(self, position, texture):
-        x, y, z = position
-        vertex_data = cube_vertices(x, y - self.world[position].height, z, 0.5)
-        texture_data = list(texture)
-        self._shown[position] = self.batch.add(24, GL_QUADS, self.group,('v3f/static', vertex_data),('t2f/static', texture_data))
-
-    def hide_block(self, position, immediate=True):
-        self.shown.pop(position)
-        if immediate:
-            self._hide_block(position)
+class Model(core.Model):
+    # core.Model drawn with pyglet: each visible sector's meshes sit in vertex lists
+    # from a BufferPool, so sectors can be culled and a hidden sector's buffers go to the
+    # next one shown rather than being freed; the texture atlas is loaded when the first
+    # sector is uploaded
+    def __init__(self, world=None, **generation):
+        self.draw_stats = (0, 0, 0)
+        self._group = None
+        self.tile_groups = {}
+        self.buffers = buffers.BufferPool(self._create_buffer, self._destroy_buffer,
+                                          spare_limit=settings.BUFFER_SPARE_VERTICES)
+        self._shown = buffers.SectorBuffers(self.buffers)
+        self.ticks = 0
+        core.Model.__init__(self, world, **generation)
+
+    @property
+    def group(self):
+        if self._group is None:
+            self._group = TextureGroup(image.load(TEXTURE_PATH).get_texture())
+        return self._group
+
+    def _create_buffer(self, size):
+        return pyglet.graphics.vertex_list(size, 'v3f/dynamic', 't2f/dynamic', 'c3B/dynamic')
+
+    def _destroy_buffer(self, vertex_list):
+        vertex_list.delete()
+
+    def _upload_sector(self, sector, meshes, shown):
+        core.Model._upload_sector(self, sector, meshes, shown)
+        meshes = dict((mesh[0], mesh[1:]) for mesh in meshes if mesh[1]) if sector in self.visible else {}
+        slots = self._shown.assign(sector, [(tile, len(mesh[0]) // 3) for tile, mesh in meshes.items()])
+        for tile, slot in slots:
+            vertex_data, texture_data, color_data = meshes[tile]
+            vertex_list = slot.buffer
+            # each slot's list is alone in a domain made to the slot's size, so this stays
+            # in place, and drawing the list draws only the vertices in use
+            vertex_list.resize(slot.count)
+            vertex_list.vertices[:] = vertex_data
+            vertex_list.tex_coords[:] = texture_data
+            vertex_list.colors[:] = color_data
+
+    def draw(self, position=None, rotation=None, aspect=1.0):
+        # draws the sectors in view of a camera at position/rotation, or all of them,
+        # binding each texture once
+        shown = self._shown.sectors
+        if position is None or not settings.FRUSTUM_CULLING:
+            sectors = list(shown)
         else:
-            self._enqueue(self._hide_block, position)
-
-    def _hide_block(self, position):
-        self._shown.pop(position).delete()
-
-    def show_sector(self, sector):
-        for position in self.sectors.get(sector, []):
-            if position not in self.shown and self.exposed(position):
-                self.show_block(position, False)
-
-    def hide_sector(self, sector):
-        for position in self.sectors.get(sector, []):
-            if position in self.shown:
-                self.hide_block(position, False)
-
-    def change_sectors(self, before, after):
-        before_set = set()
-        after_set = set()
-        pad = 4
-        for dx in xrange(-pad, pad + 1):
-            for dy in [0]:
-                for dz in xrange(-pad, pad + 1):
-                    if dx ** 2 + dy ** 2 + dz ** 2 > (pad + 1) ** 2:
-                        continue
-                    if before:
-                        x, y, z = before
-                        before_set.add((x + dx, y + dy, z + dz))
-                    if after:
-                        x, y, z = after
-                        after_set.add((x + dx, y + dy, z + dz))
-        show = after_set - before_set
-        hide = before_set - after_set
-        for sector in show:
-            self.show_sector(sector)
-        for sector in hide:
-            self.hide_sector(sector)
-
-    def _enqueue(self, func, *args):
-        self.queue.append((func, args))
-
-    def _dequeue(self):
-        func, args = self.queue.popleft()
-        func(*args)
-
-    def process_queue(self):
-        start = timefunc()
-        while self.queue and timefunc() - start < 1.0 / TICKS_PER_SEC:
-            self._dequeue()
-
-    def process_entire_queue(self):
-        while self.queue:
-            self._dequeue()
+            sectors = [sector for sector in self.cull(position, rotation, aspect) if sector in shown]
+        groups = {}
+        vertices = 0
+        for sector in sectors:
+            for tile, slot in shown[sector]:
+                groups.setdefault(tile, []).append((sector, slot.buffer))
+                vertices += slot.count
+        for tile, lists in groups.items():
+            group = self.group if tile is None else self.tile_group(tile)
+            group.set_state()
+            for sector, vertex_list in lists:
+                glPushMatrix()
+                glTranslatef(*sector_origin(sector))
+                vertex_list.draw(GL_QUADS)
+                glPopMatrix()
+            group.unset_state()
+        self.draw_stats = (len(sectors), len(shown), vertices)
+
+    def tick(self):
+        core.Model.tick(self)
+        self.ticks += 1
+        if not self.ticks % settings.BUFFER_COMPACT_TICKS:
+            self.buffers.compact()
+
+    def close(self):
+        core.Model.close(self)
+        for sector in list(self._shown.sectors):
+            self._shown.assign(sector, [])
+        self.buffers.clear()
+
+    def tile_group(self, tile):
+        if tile not in self.tile_groups:
+            atlas = image.load(TEXTURE_PATH)
+            w, h = atlas.width // mesher.ATLAS_SIZE, atlas.height // mesher.ATLAS_SIZE
+            texture = image.TileableTexture.create_for_image(atlas.get_region(tile[0] * w, tile[1] * h, w, h))
+            glBindTexture(texture.target, texture.id)
+            glTexParameteri(texture.target, GL_TEXTURE_WRAP_S, GL_REPEAT)
+            glTexParameteri(texture.target, GL_TEXTURE_WRAP_T, GL_REPEAT)
+            glTexParameteri(texture.target, GL_TEXTURE_MIN_FILTER, GL_NEAREST)
+            glTexParameteri(texture.target, GL_TEXTURE_MAG_FILTER, GL_NEAREST)
+            self.tile_groups[tile] = TextureGroup(texture)
+        return self.tile_groups[tile]
 
 class Window(pyglet.window.Window):
     def __init__(self, *args, **kwargs):
         super(Window, self).__init__(*args, **kwargs)
 
         self.saver_loader = 'pickle'
-        # self.loading_image = image.load('textures/loading.png')
-        # self.loaded = False
-        # pyglet.clock.schedule(self._loading_screen, 1)
-        # if settings.LOG_WORLD_GEN_PROGRESS:
-        #     thread.start_new_thread(self._load, ())
-        # else:
-        #     self._init()
+        self.loading_image = image.load('textures/loading.png')
+        self.loaded = False
         self._init()
-        # pyglet.app.run()
-
-    def _load(self):
-        pyglet.clock.schedule_once(self._init, 0)
 
     def _init(self, dt=0):
         self.exclusive = False
@@ -347,11 +142,10 @@ class Window(pyglet.window.Window):
         self.running = False
         self.gamemode = 1
         self.strafe = [0, 0]
-        self.position = (0, 0, 0)
+        self.body = physics.Body()
         self.rotation = (0, 0)
         self.sector = None
         self.reticle = None
-        self.dy = 0
         self.health = 20
         self.inventory = BLOCKS + HALFBLOCKS
         self.block = self.inventory[0]
@@ -359,6 +153,11 @@ class Window(pyglet.window.Window):
             key._1, key._2, key._3, key._4, key._5,
             key._6, key._7, key._8, key._9]
         self.model = Model()
+        self.model.listeners.append(self.on_block_change)
+        self.model.physics.add(self.body)
+        self.focus_key = None
+        self.focus = None
+        self.focus_outline = None
         self.clear_color = (0.5, 0.69, 1.0)
         self.label = pyglet.text.Label('', font_name='Arial', font_size=18,
             x=10, y=self.height - 10, anchor_x='left', anchor_y='top',
@@ -370,16 +169,21 @@ class Window(pyglet.window.Window):
             x=10, y=20, anchor_x='left', anchor_y='bottom',
             color=(240, 240, 240, 255))
         self.chatbox_history = []
-        self.loaded = True
         pyglet.clock.schedule_interval(self.update, 1.0 / TICKS_PER_SEC)
 
-    def _loading_screen(self, *p, **k):
+    def _loading_screen(self):
         self.clear()
-        self.loading_image.blit(0, 0)
-        if not self.loaded:
-            pyglet.clock.schedule(self._loading_screen, 1)
-        else:
-            del self.loaded, self.loading_image
+        self.set_2d()
+        glColor3d(1, 1, 1)
+        self.loading_image.blit(0, 0, width=self.width, height=self.height)
+
+    @property
+    def position(self):
+        return self.body.position
+
+    @position.setter
+    def position(self, position):
+        self.body.position = position
 
     def set_exclusive_mouse(self, exclusive):
         super(Window, self).set_exclusive_mouse(exclusive)
@@ -423,17 +227,20 @@ class Window(pyglet.window.Window):
         return (dx, dy, dz)
 
     def update(self, dt):
-        self.model.process_queue()
+        start = clock()
+        self.model.tick()
         sector = sectorize(self.position)
         if sector != self.sector:
             self.model.change_sectors(self.sector, sector)
-            if self.sector is None:
+            if self.sector is None and self.model.workers is None:
                 self.model.process_entire_queue()
             self.sector = sector
-        m = 8
+        if not self.loaded:
+            self.loaded = not self.model.busy()
         dt = min(dt, 0.2)
-        for _ in xrange(m):
-            self._update(dt / m)
+        self._update(dt)
+        # queued sector work gets what is left of the frame after ticking, moving and drawing
+        self.model.process_queue(start)
         y = self.position[1]
         u = (0.5, 0.69, 1.0)
         l = (0, 0, 0)
@@ -461,56 +268,28 @@ class Window(pyglet.window.Window):
             speed = RUNNING_SPEED
         else:
             speed = WALKING_SPEED
-        d = dt * speed
         dx, dy, dz = self.get_motion_vector()
-        dx, dy, dz = dx * d, dy * d, dz * d
-        if not self.flying:
-            self.dy -= dt * GRAVITY
-            self.dy = max(self.dy, -TERMINAL_VELOCITY)
-            dy += self.dy * dt
-        x, y, z = self.position
-        if not (self.gamemode == 4 or self.gamemode == 3):
-            x, y, z = self.collide((x + dx, y + dy, z + dz), PLAYER_HEIGHT)
-        else:
-            x, y, z = x + dx, y + dy, z + dz
-        self.position = (x, y, z)
+        body = self.body
+        body.vx, body.vz = dx * speed, dz * speed
+        if self.flying:
+            body.vy = dy * speed
+        body.gravity = not self.flying
+        body.collides = not (self.gamemode == 4 or self.gamemode == 3)
+        self.model.physics.update(dt)
 
     def death(self):
         self.health = 20
         self.position = (0, 0, 0)
+        self.body.vy = 0.0
 
     def toggle_chatbox(self):
         self.chatbox_open = not self.chatbox_open
         pass
 
-    def collide(self, position, height):
-        pad = 0.25
-        p = list(position)
-        np = normalize(position)
-        for face in FACES:
-            for i in xrange(3):
-                if not face[i]:
-                    continue
-                d = (p[i] - np[i]) * face[i]
-                if d < pad:
-                    continue
-                for dy in xrange(height):
-                    op = list(np)
-                    op[1] -= dy
-                    op[i] += face[i]
-                    if tuple(op) not in self.model.world:
-                        continue
-                    p[i] -= (d - pad) * face[i]
-                    if face == (0, -1, 0) or face == (0, 1, 0):
-                        self.dy = 0
-                    break
-        return tuple(p)
-
     def on_mouse_press(self, x, y, button, modifiers):
         if self.exclusive:
             if self.gamemode != 3:
-                vector = self.get_sight_vector()
-                block, previous = self.model.hit_test(self.position, vector)
+                block, previous, face = self.get_focus()
                 if (button == mouse.RIGHT) or \
                         ((button == mouse.LEFT) and (modifiers & key.MOD_CTRL)):
                     if previous and not self.position[1] == y and not self.position[1] + 1 == y:
@@ -548,8 +327,8 @@ class Window(pyglet.window.Window):
         elif symbol == key.D or symbol == key.RIGHT:
             self.strafe[1] += 1
         elif symbol == key.SPACE:
-            if self.dy == 0 or self.flying:
-                self.dy += JUMP_SPEED
+            if self.body.on_ground or self.flying:
+                self.body.vy += JUMP_SPEED
         # elif symbol == key.T or symbol == key.SLASH:
         #     self.set_exclusive_mouse(False)
         #     self.chatbox_open = True
@@ -616,7 +395,7 @@ class Window(pyglet.window.Window):
         glViewport(0, 0, width, height)
         glMatrixMode(GL_PROJECTION)
         glLoadIdentity()
-        gluPerspective(65.0, width / float(height), 0.1, 60.0)
+        gluPerspective(FIELD_OF_VIEW, width / float(height), NEAR_PLANE, self.model.far_plane)
         glMatrixMode(GL_MODELVIEW)
         glLoadIdentity()
         x, y = self.rotation
@@ -626,10 +405,15 @@ class Window(pyglet.window.Window):
         glTranslatef(-x, -y, -z)
 
     def on_draw(self):
+        if not self.loaded:
+            self._loading_screen()
+            return
+        start = clock()
         self.clear()
         self.set_3d()
         glColor3d(1, 1, 1)
-        self.model.batch.draw()
+        width, height = self.get_size()
+        self.model.draw(self.position, self.rotation, width / float(height))
         self.draw_focused_block()
         self.set_2d()
         if not self.chatbox_open:
@@ -637,16 +421,34 @@ class Window(pyglet.window.Window):
             if self.showLabel: self.draw_reticle()
         else:
             self.draw_chatbox()
+        self.model.queue.record_draw(clock() - start)
+
+    def get_focus(self):
+        key = (self.position, self.rotation)
+        if key != self.focus_key:
+            self.focus_key = key
+            self.focus = self.model.hit_test(self.position, self.get_sight_vector())
+        return self.focus
+
+    def on_block_change(self, position):
+        x, y, z = position
+        px, py, pz = self.position
+        if (x - px) ** 2 + (y - py) ** 2 + (z - pz) ** 2 <= (FOCUS_DISTANCE + 1) ** 2:
+            self.focus_key = None
 
     def draw_focused_block(self):
-        vector = self.get_sight_vector()
-        block = self.model.hit_test(self.position, vector)[0]
+        block = self.get_focus()[0]
         if block and self.gamemode != 3:
+            # one outline around the origin, moved onto whichever block is in focus
+            if self.focus_outline is None:
+                self.focus_outline = pyglet.graphics.vertex_list(24, ('v3f/static', cube_vertices(0, 0, 0, 0.51)))
             x, y, z = block
-            vertex_data = cube_vertices(x, y - self.model.world[block].height, z, 0.51)
             glColor3d(0, 0, 0)
             glPolygonMode(GL_FRONT_AND_BACK, GL_LINE)
-            pyglet.graphics.draw(24, GL_QUADS, ('v3f/static', vertex_data))
+            glPushMatrix()
+            glTranslatef(x, y - self.model.world[block].height, z)
+            self.focus_outline.draw(GL_QUADS)
+            glPopMatrix()
             glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
 
     def draw_chatbox(self):
@@ -676,6 +478,15 @@ class Window(pyglet.window.Window):
         if mode == 3 or mode == 4:
             self.flying = True
 
+    def set_model(self, model):
+        self.model.close()
+        self.model = model
+        self.model.listeners.append(self.on_block_change)
+        self.model.physics.add(self.body)
+        self.focus_key = None
+        self.sector = None
+        self.loaded = False
+
     def command_exec(self, cmd):
         cmd = cmd.lstrip('/')
         # print(cmd)
@@ -693,9 +504,9 @@ class Window(pyglet.window.Window):
             self.set_gamemode(int(self.args))
         elif cmd == 'loadseed':
             random.seed(int(args))
-            self.world = Model()
+            self.set_model(Model())
         elif cmd == 'newworld':
-            self.world = Model()
+            self.set_model(Model())
             self.position = (0, 0, 0)
             self.rotation = (0, 0)
         elif cmd == 'seed':
@@ -703,26 +514,41 @@ class Window(pyglet.window.Window):
         elif cmd == 'savefmt':
             self.saver_loader = args
         elif cmd == 'save':
-            # saver = __import__(self.saver_loader + '_format')
-            saver = settings.saver_loader
-            print(dir(saver))
-            print(type(saver.save))
-            saver.save(self.args, world=self.world, position=self.position, rotation=self.rotation)
+            # a bad format name or file is reported here rather than raised out of the key handler
+            try:
+                saver = importlib.import_module('savers_and_loaders.%s_format' % self.saver_loader)
+                saver.save(args, world=self.model.world, position=self.position, rotation=self.rotation)
+            except (ImportError, IOError, OSError, ValueError, TypeError) as error:
+                print('Could not save %r as %s: %s' % (args, self.saver_loader, error))
         elif cmd == 'load':
-            # loader = __import__(self.saver_loader + '_format')
-            loader = settings.saver_loader
-            val = loader.load(self.args)
-            self.world = val['world']
+            try:
+                loader = importlib.import_module('savers_and_loaders.%s_format' % self.saver_loader)
+                val = loader.load(args)
+            except (ImportError, IOError, OSError, ValueError, TypeError, KeyError) as error:
+                print('Could not load %r as %s: %s' % (args, self.saver_loader, error))
+                return
+            self.set_model(Model(val['world']))
             self.position = val['position']
             self.rotation = val['rotation']
         elif cmd == 'say':
             print(args)
+        elif cmd == 'viewdistance':
+            distances = [int(x) for x in args.split()]
+            self.model.set_view_distance(*distances)
+            print('View distance %i sectors, full detail within %i' % (self.model.view_distance, self.model.lod_distance))
+        elif cmd == 'queue':
+            stats = self.model.queue.stats()
+            print(', '.join('%s %s' % (name, stats[name]) for name in sorted(stats)))
+        elif cmd == 'buffers':
+            stats = self.model.buffers.stats()
+            print(', '.join('%s %i' % (name, stats[name]) for name in sorted(stats)))
 
     def draw_label(self):
         x, y, z = self.position
-        self.label.text = '%02d (%.2f, %.2f, %.2f) %d / %d' % (
+        drawn, sectors, vertices = self.model.draw_stats
+        self.label.text = '%02d (%.2f, %.2f, %.2f) %d / %d sectors %d / %d (%d vertices) queue %d' % (
             pyglet.clock.get_fps(), x, y, z,
-            len(self.model._shown), len(self.model.world))
+            len(self.model.shown), len(self.model.world), drawn, sectors, vertices, len(self.model.queue))
         self.hudLabel.text = 'CurrentBlock:%s Health:%i' % (
             self.block.name, self.health
         )
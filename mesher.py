@@ -0,0 +1,290 @@
+import itertools, threading
+from array import array
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+from world import FACES, FACE_BITS, SECTOR_SIZE, CHUNK_OFFSETS, sector_origin
+
+def cube_vertices(x, y, z, n):
+    return [
+        x-n,y+n,z-n, x-n,y+n,z+n, x+n,y+n,z+n, x+n,y+n,z-n,
+        x-n,y-n,z-n, x+n,y-n,z-n, x+n,y-n,z+n, x-n,y-n,z+n,
+        x-n,y-n,z-n, x-n,y-n,z+n, x-n,y+n,z+n, x-n,y+n,z-n,
+        x+n,y-n,z+n, x+n,y-n,z-n, x+n,y+n,z-n, x+n,y+n,z+n,
+        x-n,y-n,z+n, x+n,y-n,z+n, x+n,y+n,z+n, x-n,y+n,z+n,
+        x+n,y-n,z-n, x-n,y-n,z-n, x-n,y+n,z-n, x+n,y+n,z-n,
+    ]
+
+def tex_coord(x, y, n=8):
+    m = 1.0 / n
+    dx = x * m
+    dy = y * m
+    return dx, dy, dx + m, dy, dx + m, dy + m, dx, dy + m
+
+def tex_coords(top, bottom, side):
+    top = tex_coord(*top)
+    bottom = tex_coord(*bottom)
+    side = tex_coord(*side)
+    result = []
+    result.extend(top)
+    result.extend(bottom)
+    result.extend(side * 4)
+    return result
+
+# meshes are arrays of floats relative to their sector's origin (see world.sector_origin);
+# main.Model moves each sector into place when drawing it
+FACE_RANGE = range(len(FACES))
+# the colour array of one quad at each brightness
+SHADES = [array('B', [level]) * 12 for level in range(256)]
+FULL_BRIGHT = SHADES[255]
+
+_templates = {}
+def face_templates(height):
+    # the vertices of every face of every cell of a sector for blocks lowered by height,
+    # at index cell * 6 + face with cells numbered x fastest, then z, then y
+    templates = _templates.get(height)
+    if templates is None:
+        templates = []
+        for y in range(SECTOR_SIZE):
+            for z in range(SECTOR_SIZE):
+                for x in range(SECTOR_SIZE):
+                    cube = cube_vertices(x, y - height, z, 0.5)
+                    templates.extend(array('f', cube[face * 12:face * 12 + 12]) for face in FACE_RANGE)
+        _templates[height] = templates
+    return templates
+
+def build_sector(world, sector, positions, shown=None, light=None):
+    # one quad per exposed face of a block in the sector (see World.face_mask; half blocks
+    # are drawn shifted down, so only a neighbour at the same offset hides a face),
+    # coloured by the light in front of it; exposed blocks are also recorded in shown.
+    # Quads are copied from face_templates, so no floats are made per block.
+    vertices = array('f')
+    textures = array('f')
+    colors = array('B')
+    get_id = world.get_id
+    palette = world.palette
+    face_mask = world.face_mask
+    ox, oy, oz = sector_origin(sector)
+    size = SECTOR_SIZE
+    templates = {}
+    for position in positions:
+        x, y, z = position
+        mask = face_mask(x, y, z)
+        if not mask:
+            continue
+        block = palette[get_id(x, y, z)]
+        if shown is not None:
+            shown[position] = block.texture
+        cells = templates.get(block.height)
+        if cells is None:
+            cells = templates[block.height] = face_templates(block.height)
+        base = (((y - oy) * size + z - oz) * size + x - ox) * 6
+        faces = block.faces
+        for face in FACE_RANGE:
+            if not mask & FACE_BITS[face]:
+                continue
+            vertices.extend(cells[base + face])
+            textures.extend(faces[face])
+            if light is None:
+                colors.extend(FULL_BRIGHT)
+            else:
+                dx, dy, dz = FACES[face]
+                colors.extend(SHADES[light.brightness(x + dx, y + dy, z + dz)])
+    return vertices, textures, colors
+
+ATLAS_SIZE = 8
+# normal, u and v axes of the plane each of FACES lies in
+FACE_AXES = [(1, 0, 2), (1, 0, 2), (0, 2, 1), (0, 2, 1), (2, 0, 1), (2, 0, 1)]
+FACE_CORNERS = []
+FACE_TEX_AXES = []
+for face in range(len(FACES)):
+    quad = cube_vertices(0, 0, 0, 1)[face * 12:face * 12 + 12]
+    corners = [tuple(quad[i:i + 3]) for i in range(0, 12, 3)]
+    FACE_CORNERS.append(corners)
+    FACE_TEX_AXES.append((
+        [i for i in range(3) if corners[0][i] != corners[1][i]][0],
+        [i for i in range(3) if corners[1][i] != corners[2][i]][0]))
+TEX_CORNERS = [(0, 0), (1, 0), (1, 1), (0, 1)]
+
+def texture_tiles(texture):
+    # atlas tile (column, row) of each face of a block texture
+    return tuple((int(round(texture[face * 8] * ATLAS_SIZE)), int(round(texture[face * 8 + 1] * ATLAS_SIZE)))
+                 for face in range(len(FACES)))
+
+def merge_rects(cells):
+    # greedily cover a set of (u, v) cells with (u, v, width, height) rectangles
+    rects = []
+    for u, v in sorted(cells, key=lambda cell: (cell[1], cell[0])):
+        if (u, v) not in cells:
+            continue
+        w = 1
+        while (u + w, v) in cells:
+            w += 1
+        h = 1
+        while all((u + i, v + h) in cells for i in range(w)):
+            h += 1
+        for j in range(h):
+            for i in range(w):
+                cells.discard((u + i, v + j))
+        rects.append((u, v, w, h))
+    return rects
+
+def build_sector_greedy(world, sector, positions, shown=None, light=None):
+    # like build_sector, but merges coplanar faces sharing an atlas tile and light into
+    # larger quads; returns {tile: (vertices, textures, colors)} with texture coordinates
+    # in tile units, to be drawn with a repeating texture per tile
+    planes = {}
+    get_id = world.get_id
+    palette = world.palette
+    face_mask = world.face_mask
+    for position in positions:
+        x, y, z = position
+        mask = face_mask(x, y, z)
+        if not mask:
+            continue
+        block = palette[get_id(x, y, z)]
+        if shown is not None:
+            shown[position] = block.texture
+        tiles = block.tiles
+        for face, (dx, dy, dz) in enumerate(FACES):
+            if not mask & FACE_BITS[face]:
+                continue
+            n, u, v = FACE_AXES[face]
+            brightness = 255 if light is None else light.brightness(x + dx, y + dy, z + dz)
+            key = (face, position[n], block.height, tiles[face], brightness)
+            cells = planes.get(key)
+            if cells is None:
+                cells = planes[key] = set()
+            cells.add((position[u], position[v]))
+    meshes = {}
+    origin = sector_origin(sector)
+    for (face, p, height, tile, brightness), cells in planes.items():
+        if tile not in meshes:
+            meshes[tile] = (array('f'), array('f'), array('B'))
+        vertices, textures, colors = meshes[tile]
+        n, u, v = FACE_AXES[face]
+        s_axis, t_axis = FACE_TEX_AXES[face]
+        corners = FACE_CORNERS[face]
+        for u0, v0, w, h in merge_rects(cells):
+            extent = [1, 1, 1]
+            extent[u], extent[v] = w, h
+            for k, corner in enumerate(corners):
+                coords = [0, 0, 0]
+                coords[n] = p - origin[n] + corner[n] * 0.5
+                coords[u] = u0 - origin[u] - 0.5 if corner[u] < 0 else u0 - origin[u] + w - 0.5
+                coords[v] = v0 - origin[v] - 0.5 if corner[v] < 0 else v0 - origin[v] + h - 0.5
+                coords[1] -= height
+                vertices.extend(coords)
+                textures.append(TEX_CORNERS[k][0] * extent[s_axis])
+                textures.append(TEX_CORNERS[k][1] * extent[t_axis])
+                colors.extend((brightness, brightness, brightness))
+    return meshes
+
+def build(world, sector, positions, greedy=False, shown=None, light=None):
+    # [(atlas tile or None for the whole atlas, vertices, textures, colors)] for one sector
+    if greedy:
+        meshes = build_sector_greedy(world, sector, positions, shown, light)
+        return [(tile,) + mesh for tile, mesh in meshes.items()]
+    return [(None,) + build_sector(world, sector, positions, shown, light)]
+
+LOD_SCALE = 2
+# distant sectors get no light worked out; their sides are shaded a little so hills keep their shape
+LOD_TOP = SHADES[255]
+LOD_SIDE = SHADES[204]
+
+def lod_quad(face, x0, y0, z0, x1, y1, z1):
+    # the FACES[face] side of the box from (x0, y0, z0) to (x1, y1, z1)
+    vertices = []
+    for cx, cy, cz in FACE_CORNERS[face]:
+        vertices.extend((x0 if cx < 0 else x1, y0 if cy < 0 else y1, z0 if cz < 0 else z1))
+    return vertices
+
+def build_lod(world, sector, scale=LOD_SCALE):
+    # a coarse mesh for a distant sector: the columns are merged scale x scale into cells
+    # as tall as their highest block and topped with its texture, with walls down to the
+    # next cell and down to the bottom of the sector around the edge. Read straight from
+    # the sector's chunk, which lists blocks bottom layer first.
+    vertices, textures, colors = array('f'), array('f'), array('B')
+    chunk = world.chunks.get(sector)
+    if chunk is None:
+        return [(None, vertices, textures, colors)]
+    palette = world.palette
+    tops = {}
+    bottom = None
+    for (x, y, z), block_id in zip(CHUNK_OFFSETS, chunk):
+        if block_id:
+            tops[(x // scale, z // scale)] = (y, block_id)
+            if bottom is None:
+                bottom = y
+    heights = {}
+    blocks = {}
+    for cell, (y, block_id) in tops.items():
+        block = blocks[cell] = palette[block_id]
+        heights[cell] = y + 0.5 - block.height
+    floor = bottom - 0.5
+    for (u, v), height in heights.items():
+        block = blocks[(u, v)]
+        x0, z0 = u * scale - 0.5, v * scale - 0.5
+        x1, z1 = x0 + scale, z0 + scale
+        vertices.extend(lod_quad(0, x0, height - 1, z0, x1, height, z1))
+        textures.extend(block.faces[0])
+        colors.extend(LOD_TOP)
+        for face, (dx, dy, dz) in enumerate(FACES):
+            if dy:
+                continue
+            below = heights.get((u + dx, v + dz), floor)
+            if below < height:
+                vertices.extend(lod_quad(face, x0, below, z0, x1, height, z1))
+                textures.extend(block.faces[face])
+                colors.extend(LOD_SIDE)
+    return [(None, vertices, textures, colors)]
+
+class MeshWorkers(object):
+    # builds sector meshes on background threads; the threads only read the world,
+    # so a result can be stale by the time it is collected and callers tag jobs
+    # with a version to tell
+    def __init__(self, world, count, light=None):
+        self.world = world
+        self.light = light
+        # nearest sectors first: jobs are ordered by the priority they are submitted with
+        self.jobs = queue.PriorityQueue()
+        self.order = itertools.count()
+        self.results = queue.Queue()
+        self.in_flight = 0
+        self.threads = []
+        for _ in range(count):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, sector, version, positions, greedy=False, priority=0):
+        self.in_flight += 1
+        self.jobs.put((priority, next(self.order), (sector, version, positions, greedy)))
+
+    def collect(self, block=False):
+        try:
+            result = self.results.get(block)
+        except queue.Empty:
+            return None
+        self.in_flight -= 1
+        return result
+
+    def stop(self):
+        for _ in self.threads:
+            self.jobs.put((float('-inf'), next(self.order), None))
+
+    def _work(self):
+        while True:
+            priority, order, job = self.jobs.get()
+            if job is None:
+                return
+            sector, version, positions, greedy = job
+            shown = {}
+            try:
+                meshes = build(self.world, sector, positions, greedy, shown, self.light)
+            except Exception:
+                # a block went away mid-build; the main thread rebuilds the sector itself
+                meshes = None
+            self.results.put((sector, version, meshes, shown))
@@ -0,0 +1,166 @@
+from __future__ import division
+import math
+from world import CHUNK_BITS
+
+EPSILON = 1e-6
+
+class Body(object):
+    # an axis-aligned box around (x, y, z): radius out to the sides, below and above
+    # the position vertically; the defaults are the player's (eye height 1.25)
+    __slots__ = ('x', 'y', 'z', 'vx', 'vy', 'vz', 'radius', 'below', 'above',
+                 'gravity', 'collides', 'on_ground', 'on_ceiling')
+
+    def __init__(self, position=(0, 0, 0), radius=0.25, below=1.25, above=0.25):
+        self.x, self.y, self.z = position
+        self.vx = self.vy = self.vz = 0.0
+        self.radius = radius
+        self.below = below
+        self.above = above
+        self.gravity = True
+        self.collides = True
+        self.on_ground = False
+        self.on_ceiling = False
+
+    @property
+    def position(self):
+        return (self.x, self.y, self.z)
+
+    @position.setter
+    def position(self, position):
+        self.x, self.y, self.z = position
+
+class Physics(object):
+    # moves bodies through a World in fixed steps; each step sweeps a body's box along
+    # y, x and z in turn against every voxel the move passes through, so nothing tunnels.
+    # Blocks are unit boxes lowered by their height (see mesher.build_sector).
+    def __init__(self, world, gravity=20.0, terminal_velocity=50, step=1 / 60, max_steps=12):
+        self.world = world
+        self.gravity = gravity
+        self.terminal_velocity = terminal_velocity
+        self.step = step
+        self.max_steps = max_steps
+        self.bodies = []
+        self.groups = []
+        self.time = 0.0
+        self.heights = [0.0]
+        self.lo = [0.0, 0.0, 0.0]
+        self.hi = [0.0, 0.0, 0.0]
+
+    def add(self, body):
+        self.bodies.append(body)
+        return body
+
+    def remove(self, body):
+        self.bodies.remove(body)
+
+    def update(self, dt):
+        # runs as many whole steps as dt covers and returns how many ran
+        self.time = min(self.time + dt, self.step * self.max_steps)
+        steps = 0
+        while self.time >= self.step:
+            self.time -= self.step
+            self.tick(self.step)
+            steps += 1
+        return steps
+
+    def tick(self, dt):
+        palette = self.world.palette
+        if len(self.heights) != len(palette):
+            self.heights = [0.0] + [block.height for block in palette[1:]]
+        for body in self.bodies:
+            self.move(body, dt)
+        for group in self.groups:
+            group.step(dt)
+
+    def move(self, body, dt):
+        if body.gravity:
+            body.vy = max(body.vy - dt * self.gravity, -self.terminal_velocity)
+        dx, dy, dz = body.vx * dt, body.vy * dt, body.vz * dt
+        r = body.radius
+        if not body.collides or self.clear(body.x - r + min(dx, 0), body.y - body.below + min(dy, 0), body.z - r + min(dz, 0),
+                                           body.x + r + max(dx, 0), body.y + body.above + max(dy, 0), body.z + r + max(dz, 0)):
+            body.on_ground = body.on_ceiling = False
+            body.x += dx
+            body.y += dy
+            body.z += dz
+            return
+        lo, hi = self.lo, self.hi
+        lo[0], lo[1], lo[2] = body.x - r, body.y - body.below, body.z - r
+        hi[0], hi[1], hi[2] = body.x + r, body.y + body.above, body.z + r
+        body.on_ground = body.on_ceiling = False
+        if dy:
+            moved = self.sweep(1, dy)
+            if moved != dy:
+                if dy < 0:
+                    body.on_ground = True
+                else:
+                    body.on_ceiling = True
+                body.vy = 0.0
+            body.y += moved
+            lo[1] += moved
+            hi[1] += moved
+        if dx:
+            moved = self.sweep(0, dx)
+            body.x += moved
+            lo[0] += moved
+            hi[0] += moved
+        if dz:
+            body.z += self.sweep(2, dz)
+
+    def clear(self, x0, y0, z0, x1, y1, z1):
+        # whether no stored chunk touches the box, i.e. anything inside it can move freely
+        floor, chunks = math.floor, self.world.chunks
+        cx0, cx1 = int(floor(x0 + 0.5)) >> CHUNK_BITS, int(floor(x1 + 0.5)) >> CHUNK_BITS
+        cy0, cy1 = int(floor(y0 + 0.5)) >> CHUNK_BITS, int(floor(y1 + 1.5)) >> CHUNK_BITS
+        cz0, cz1 = int(floor(z0 + 0.5)) >> CHUNK_BITS, int(floor(z1 + 0.5)) >> CHUNK_BITS
+        if cx0 == cx1 and cy0 == cy1 and cz0 == cz1:
+            return (cx0, cy0, cz0) not in chunks
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                for cz in range(cz0, cz1 + 1):
+                    if (cx, cy, cz) in chunks:
+                        return False
+        return True
+
+    def sweep(self, axis, delta):
+        # how far the box in lo/hi can move along axis, up to delta
+        lo, hi = self.lo, self.hi
+        x0, y0, z0 = lo
+        x1, y1, z1 = hi
+        if axis == 0:
+            if delta > 0: x1 += delta
+            else: x0 += delta
+        elif axis == 1:
+            if delta > 0: y1 += delta
+            else: y0 += delta
+        else:
+            if delta > 0: z1 += delta
+            else: z0 += delta
+        floor, ceil = math.floor, math.ceil
+        ix0, ix1 = int(floor(x0 + 0.5 + EPSILON)), int(ceil(x1 + 0.5 - EPSILON))
+        iz0, iz1 = int(floor(z0 + 0.5 + EPSILON)), int(ceil(z1 + 0.5 - EPSILON))
+        # one more row on top for blocks lowered into the box
+        iy0, iy1 = int(floor(y0 + 0.5 + EPSILON)), int(ceil(y1 + 0.5 - EPSILON)) + 1
+        start, end = lo[axis], hi[axis]
+        by0, by1 = lo[1] + EPSILON, hi[1] - EPSILON
+        get_id = self.world.get_id
+        heights = self.heights
+        for ix in range(ix0, ix1):
+            for iz in range(iz0, iz1):
+                for iy in range(iy0, iy1):
+                    block_id = get_id(ix, iy, iz)
+                    if not block_id:
+                        continue
+                    bottom = iy - 0.5 - heights[block_id]
+                    if axis == 1:
+                        near = bottom
+                    else:
+                        if bottom >= by1 or bottom + 1 <= by0:
+                            continue
+                        near = (ix if axis == 0 else iz) - 0.5
+                    if delta > 0:
+                        if end - EPSILON <= near < end + delta:
+                            delta = near - end
+                    elif start + EPSILON >= near + 1 > start + delta:
+                        delta = near + 1 - start
+        return delta
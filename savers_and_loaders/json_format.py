@@ -1,9 +1,8 @@
 import json
-import main
+from world import World, BLOCK_TYPES
 
 def save(name, **parts):
-    parts['world'] = parts['world'].world
-    __import__('pprint').pprint(parts)
+    parts['world'] = [[x, y, z, block.name] for (x, y, z), block in parts['world'].materialize().items()]
     file = open('saves/%s.json' % name, 'w')
     json.dump(parts, file)
     file.close()
@@ -12,5 +11,10 @@ def load(name):
     file = open('saves/%s.json' % name, 'r')
     val = json.load(file)
     file.close()
-    val['world'] = main.Model(val['world'])
-    return val
\ No newline at end of file
+    world = World()
+    for x, y, z, block in val['world']:
+        world[(x, y, z)] = BLOCK_TYPES[block]
+    val['world'] = world
+    val['position'] = tuple(val['position'])
+    val['rotation'] = tuple(val['rotation'])
+    return val
@@ -2,6 +2,7 @@ import pickle
 
 def save(name, **parts):
     print('insave')
+    parts['world'] = parts['world'].materialize()
     file = open('saves/%s.pkl' % name, 'wb')
     pickle.dump(parts, file)
     file.close()
@@ -0,0 +1,246 @@
+import io, mmap, os, pickle, struct
+import settings
+from world import World, BLOCK_TYPES, CHUNK_VOLUME
+
+# saves/<name>.region:
+#   header  'PGCR', u32 version, u64 index offset
+#   records one per sector column: u32 chunk count, then (i32 cy, CHUNK_VOLUME block IDs) per chunk
+#   index   palette names, pickled extra parts, dead record bytes and the sector column table
+MAGIC = b'PGCR'
+VERSION = 1
+HEADER = struct.Struct('<4sIQ')
+COUNT = struct.Struct('<I')
+CHUNK = struct.Struct('<i')
+NAME = struct.Struct('<H')
+GARBAGE = struct.Struct('<Q')
+ENTRY = struct.Struct('<iiQI')
+# rewrite the whole file once more than this share of it is replaced records
+COMPACT_RATIO = 0.5
+
+def region_path(name):
+    return 'saves/%s.region' % name
+
+def _record(world, cx, cz, cys):
+    parts = [COUNT.pack(len(cys))]
+    for cy in cys:
+        parts.append(CHUNK.pack(cy))
+        parts.append(world.chunks[(cx, cy, cz)].tobytes())
+    return b''.join(parts)
+
+def _index(world, parts, garbage, table):
+    out = [COUNT.pack(len(world.palette) - 1)]
+    for block in world.palette[1:]:
+        name = block.name.encode('utf-8')
+        out.append(NAME.pack(len(name)))
+        out.append(name)
+    extra = pickle.dumps(parts, 2)
+    out.append(COUNT.pack(len(extra)))
+    out.append(extra)
+    out.append(GARBAGE.pack(garbage))
+    out.append(COUNT.pack(len(table)))
+    for (cx, cz), (offset, length) in sorted(table.items()):
+        out.append(ENTRY.pack(cx, cz, offset, length))
+    return b''.join(out)
+
+def read_index(file):
+    file.seek(0)
+    magic, version, offset = HEADER.unpack(file.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('%s is not a version %i region file' % (getattr(file, 'name', file), VERSION))
+    file.seek(offset)
+    data = file.read()
+    (count,) = COUNT.unpack_from(data, 0)
+    pos = COUNT.size
+    names = []
+    for _ in range(count):
+        (length,) = NAME.unpack_from(data, pos)
+        pos += NAME.size
+        names.append(data[pos:pos + length].decode('utf-8'))
+        pos += length
+    (length,) = COUNT.unpack_from(data, pos)
+    pos += COUNT.size
+    parts = pickle.loads(data[pos:pos + length])
+    pos += length
+    (garbage,) = GARBAGE.unpack_from(data, pos)
+    pos += GARBAGE.size
+    (count,) = COUNT.unpack_from(data, pos)
+    pos += COUNT.size
+    table = {}
+    for _ in range(count):
+        cx, cz, record, length = ENTRY.unpack_from(data, pos)
+        pos += ENTRY.size
+        table[(cx, cz)] = (record, length)
+    return offset, names, parts, garbage, table
+
+def read_record(data, world, cx, cz):
+    (count,) = COUNT.unpack_from(data, 0)
+    pos = COUNT.size
+    keys = []
+    for _ in range(count):
+        (cy,) = CHUNK.unpack_from(data, pos)
+        pos += CHUNK.size
+        world.load_chunk((cx, cy, cz), data[pos:pos + CHUNK_VOLUME])
+        keys.append((cx, cy, cz))
+        pos += CHUNK_VOLUME
+    return keys
+
+class MappedWorld(World):
+    # a World over a memory-mapped region file: sector columns are read in when
+    # Model.load_sector faults them and dropped again once they are clean and far away
+    def __init__(self, path, palette=()):
+        World.__init__(self, palette)
+        self.file = None
+        self.mapping = None
+        self.resident = set()
+        self.map(path)
+
+    def map(self, path):
+        self.unmap()
+        self.file = io.open(path, 'rb')
+        offset, names, self.parts, garbage, self.table = read_index(self.file)
+        for block_name in names:
+            self.register(BLOCK_TYPES[block_name])
+        self.mapping = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.region = path
+
+    def unmap(self):
+        if self.mapping is not None:
+            self.mapping.close()
+            self.file.close()
+        self.mapping = self.file = None
+
+    def close(self):
+        self.unmap()
+
+    def record(self, column):
+        offset, length = self.table[column]
+        return self.mapping[offset:offset + length]
+
+    def fault(self, cx, cz):
+        column = (cx, cz)
+        if column in self.resident:
+            return []
+        self.resident.add(column)
+        if column not in self.table:
+            return []
+        return read_record(self.record(column), self, cx, cz)
+
+    def evict(self, keep):
+        dirty = set((cx, cz) for cx, cy, cz in self.dirty)
+        columns = self.columns()
+        evicted = []
+        for column in list(self.resident):
+            if column in keep or column in dirty or column not in self.table:
+                continue
+            cx, cz = column
+            for cy in columns.get(column, ()):
+                self.unload_chunk((cx, cy, cz))
+            self.resident.discard(column)
+            evicted.append(column)
+        return evicted
+
+    def __bool__(self):
+        return bool(self.table) or self.size > 0
+    __nonzero__ = __bool__
+
+    def materialize(self):
+        # a copy with the columns still in the file read in as well, leaving this world's
+        # resident columns as they are
+        world = World(self.palette[1:])
+        for key, chunk in self.chunks.items():
+            world.load_chunk(key, chunk)
+        for cx, cz in sorted(set(self.table) - self.resident):
+            read_record(self.record((cx, cz)), world, cx, cz)
+        world.dirty.clear()
+        return world
+
+    def __getstate__(self):
+        raise TypeError('a MappedWorld can only be saved with region_format')
+
+def _write_all(path, world, parts):
+    # written next to path and moved over it, since a MappedWorld may still be reading path
+    columns = world.columns()
+    mapped = set()
+    if isinstance(world, MappedWorld):
+        mapped = set(world.table) - world.resident
+    table = {}
+    with io.open(path + '.tmp', 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, 0))
+        offset = HEADER.size
+        for (cx, cz) in sorted(set(columns) | set(mapped)):
+            if (cx, cz) in mapped:
+                record = world.record((cx, cz))
+            else:
+                record = _record(world, cx, cz, columns[(cx, cz)])
+            file.write(record)
+            table[(cx, cz)] = (offset, len(record))
+            offset += len(record)
+        file.write(_index(world, parts, 0, table))
+        file.seek(0)
+        file.write(HEADER.pack(MAGIC, VERSION, offset))
+    os.replace(path + '.tmp', path)
+
+def _write_changed(path, world, parts):
+    # appends records for the columns changed since the last save over the old index,
+    # then writes a fresh index after them
+    with io.open(path, 'r+b') as file:
+        offset, names, _, garbage, table = read_index(file)
+        if names != [block.name for block in world.palette[1:len(names) + 1]]:
+            return False
+        columns = world.columns()
+        file.seek(offset)
+        for cx, cz in sorted(set((cx, cz) for cx, cy, cz in world.dirty)):
+            if (cx, cz) in table:
+                garbage += table.pop((cx, cz))[1]
+            if (cx, cz) in columns:
+                record = _record(world, cx, cz, columns[(cx, cz)])
+                file.write(record)
+                table[(cx, cz)] = (offset, len(record))
+                offset += len(record)
+        if garbage > COMPACT_RATIO * offset:
+            return False
+        file.write(_index(world, parts, garbage, table))
+        file.truncate()
+        file.seek(0)
+        file.write(HEADER.pack(MAGIC, VERSION, offset))
+    return True
+
+def write(path, world, parts):
+    if not (world.region == path and os.path.exists(path) and _write_changed(path, world, parts)):
+        _write_all(path, world, parts)
+    world.dirty.clear()
+    if isinstance(world, MappedWorld):
+        world.map(path)
+    world.region = path
+
+def save(name, **parts):
+    world = parts.pop('world')
+    path = region_path(name)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    if world.scratch:
+        # worlds working out of their own scratch file are copied out whole and stay on it
+        parts.update(world.save_parts())
+        _write_all(path, world, parts)
+    else:
+        write(path, world, parts)
+
+def load(name):
+    path = region_path(name)
+    with io.open(path, 'rb') as file:
+        offset, names, parts, garbage, table = read_index(file)
+        if 'generator' in parts:
+            import worldgen
+            parts['world'] = worldgen.InfiniteWorld.from_save(path, parts.pop('generator'), capacity=settings.SECTOR_CACHE_SIZE)
+            return parts
+        if settings.LAZY_REGION_LOADING:
+            parts['world'] = MappedWorld(path)
+            return parts
+        world = World([BLOCK_TYPES[block_name] for block_name in names])
+        for (cx, cz), (record, length) in sorted(table.items(), key=lambda item: item[1][0]):
+            file.seek(record)
+            read_record(file.read(length), world, cx, cz)
+    world.dirty.clear()
+    world.region = path
+    parts['world'] = world
+    return parts
@@ -0,0 +1,75 @@
+import heapq, itertools, time
+from collections import deque
+
+# wall clock time; process_time would miss time spent waiting on the GPU or other threads
+if hasattr(time, 'perf_counter'):
+    clock = time.perf_counter
+else:
+    clock = time.time
+
+class FrameScheduler(object):
+    # work put off to later frames, run lowest priority(key) first in whatever part of a
+    # frame drawing leaves over. Drawing time is the slowest of the last few on_draw calls
+    # passed to record_draw; priorities are worked out when a task is pushed and again on
+    # reprioritize(), e.g. after the player moves to another sector.
+    def __init__(self, priority, frame_time, min_time, history=30):
+        self.priority = priority
+        self.frame_time = frame_time
+        self.min_time = min_time
+        self.heap = []
+        self.order = itertools.count()
+        self.draws = deque(maxlen=history)
+        self.budget = frame_time
+        self.ran = 0
+        self.deferred = 0
+        self.deferred_frames = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, key, func, *args):
+        heapq.heappush(self.heap, (self.priority(key), next(self.order), key, func, args))
+
+    def pop(self):
+        # runs the most urgent task
+        priority, order, key, func, args = heapq.heappop(self.heap)
+        func(*args)
+
+    def reprioritize(self):
+        priority = self.priority
+        self.heap = [(priority(key), order, key, func, args) for _, order, key, func, args in self.heap]
+        heapq.heapify(self.heap)
+
+    def record_draw(self, seconds):
+        self.draws.append(seconds)
+
+    def time_left(self, start):
+        # seconds left for queued work in a frame begun at start, keeping room for a draw
+        # as slow as the slowest recent one, but never less than min_time
+        draw = max(self.draws) if self.draws else 0.0
+        return max(self.frame_time - draw - (clock() - start), self.min_time)
+
+    def run(self, start=None, poll=None):
+        # runs tasks until this frame's budget is spent. poll() is tried before each task
+        # and returns whether it did a piece of work itself (e.g. collecting a mesh from a
+        # worker thread), which then counts against the same budget.
+        now = clock()
+        self.budget = self.time_left(now if start is None else start)
+        deadline = now + self.budget
+        while clock() < deadline:
+            if poll is not None and poll():
+                continue
+            if not self.heap:
+                break
+            self.pop()
+            self.ran += 1
+        self.deferred = len(self.heap)
+        if self.heap:
+            self.deferred_frames += 1
+
+    def stats(self):
+        return {
+            'queued': len(self.heap), 'ran': self.ran, 'deferred': self.deferred,
+            'deferred_frames': self.deferred_frames, 'budget_ms': self.budget * 1000,
+            'draw_ms': max(self.draws) * 1000 if self.draws else 0.0,
+        }
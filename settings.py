@@ -1,5 +1,21 @@
 DO_BLOCK_UPDATES = False
+BLOCK_UPDATES_PER_TICK = 128
+BLOCK_UPDATE_TIME = 0.004
+FLUID_CELLS_PER_TICK = 256
+FLUID_UPDATE_TIME = 0.004
+DO_LIGHTING = True
+FRUSTUM_CULLING = True
+OCCLUSION_CULLING = False
+VIEW_DISTANCE = 6
+LOD_DISTANCE = 4
 DO_BREAK_SFX = True
 LOG_WORLD_GEN_PROGRESS = True
-
-import savers_and_loaders.pickle_format as saver_loader
\ No newline at end of file
+GREEDY_MESHING = False
+MESH_WORKERS = 2
+LAZY_REGION_LOADING = True
+INFINITE_WORLD = False
+SECTOR_CACHE_SIZE = 256
+LOD_CACHE_PAD = 2
+BUFFER_SPARE_VERTICES = 262144
+BUFFER_COMPACT_TICKS = 300
+MIN_QUEUE_TIME = 0.002
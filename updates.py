@@ -0,0 +1,111 @@
+from collections import deque
+import settings
+from scheduler import clock
+from world import FACES, sectorize
+
+# block name -> handler(updates, position, block), called when a scheduled position comes up
+HANDLERS = {}
+
+# falling blocks (and fluids) below this are dropped instead of falling forever
+VOID_Y = -64
+
+def handler(*names):
+    def register(func):
+        for name in names:
+            HANDLERS[name] = func
+        return func
+    return register
+
+def flush_changes(model, changed, deadline, batch=8):
+    # hands changed positions to model.update_blocks a batch at a time, a sector's together,
+    # while there is time before deadline and returns the ones left over; the first batch
+    # always goes through
+    positions = sorted(changed, key=sectorize)
+    done = 0
+    while done < len(positions) and (not done or clock() < deadline):
+        model.update_blocks(positions[done:done + batch])
+        done += batch
+    return set(positions[done:])
+
+class BlockUpdates(object):
+    # scheduled block ticks: changed positions and their neighbours wait in a deduplicated
+    # queue, and each tick handles them only until budget blocks have changed or
+    # time_budget seconds have passed, so a cascade of any size is spread over as many
+    # ticks as it needs. Changes are re-meshed through Model's queue.
+    def __init__(self, model, budget=128, time_budget=0.004):
+        self.model = model
+        self.world = model.world
+        self.budget = budget
+        self.time_budget = time_budget
+        self.pending = deque()
+        self.scheduled = set()
+        self.changed = set()
+        model.listeners.append(self.schedule_around)
+
+    def __len__(self):
+        return len(self.pending) + len(self.changed)
+
+    def schedule(self, position):
+        if position not in self.scheduled:
+            self.scheduled.add(position)
+            self.pending.append(position)
+
+    def schedule_around(self, position):
+        if not settings.DO_BLOCK_UPDATES:
+            return
+        x, y, z = position
+        self.schedule(position)
+        for dx, dy, dz in FACES:
+            self.schedule((x + dx, y + dy, z + dz))
+
+    def tick(self):
+        # positions scheduled during this tick wait for the next one; re-meshing the blocks
+        # changed counts against time_budget too, and what it leaves goes first next tick
+        start = clock()
+        deadline = start + self.time_budget
+        if self.changed:
+            self.flush(deadline)
+            if self.changed:
+                return 0
+        count = min(self.budget, len(self.pending))
+        world = self.world
+        # a handler's changes can take a while to relight, so room is kept for one as slow
+        # as the slowest yet this tick
+        slowest = 0.0
+        for done in range(count):
+            now = clock()
+            if len(self.changed) >= self.budget or now + slowest > deadline:
+                count = done
+                break
+            position = self.pending.popleft()
+            self.scheduled.discard(position)
+            block = world.get(position)
+            if block is not None:
+                handle = HANDLERS.get(block.name)
+                if handle is not None:
+                    handle(self, position, block)
+                    slowest = max(slowest, clock() - now)
+        if self.changed and clock() < deadline:
+            self.flush(deadline)
+        return count
+
+    def set(self, position, block):
+        self.model.add_block(position, block, immediate=False)
+        self.changed.add(position)
+
+    def remove(self, position):
+        self.model.remove_block(position, immediate=False)
+        self.changed.add(position)
+
+    def flush(self, deadline):
+        self.changed = flush_changes(self.model, self.changed, deadline)
+
+@handler('SAND')
+def fall(updates, position, block):
+    x, y, z = position
+    below = (x, y - 1, z)
+    if below in updates.world:
+        return
+    updates.remove(position)
+    if y > VOID_Y:
+        updates.set(below, block)
@@ -0,0 +1,391 @@
+from array import array
+from binascii import hexlify, unhexlify
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+SECTOR_SIZE = 8
+CHUNK_BITS = 3
+CHUNK_SIZE = 1 << CHUNK_BITS
+CHUNK_MASK = CHUNK_SIZE - 1
+CHUNK_VOLUME = CHUNK_SIZE ** 3
+EMPTY_CHUNK = b'\0' * CHUNK_VOLUME
+
+FACES = [
+    ( 0, 1, 0),
+    ( 0,-1, 0),
+    (-1, 0, 0),
+    ( 1, 0, 0),
+    ( 0, 0, 1),
+    ( 0, 0,-1),
+]
+
+# chunk arrays are laid out x fastest, then z, then y
+STRIDE_Z = CHUNK_SIZE
+STRIDE_Y = CHUNK_SIZE * CHUNK_SIZE
+
+# bit of each of FACES in an exposed-face mask; FACES come in opposite pairs, so the
+# opposite of face f is f ^ 1
+FACE_BITS = [1 << face for face in range(len(FACES))]
+# translate tables turning a nonzero byte into a face bit, and into 0xff
+FACE_TABLES = [b'\0' + bytearray([bit]) * 255 for bit in FACE_BITS]
+SOLID_TABLE = b'\0' + b'\xff' * 255
+
+# whole chunks as big integers, to compare and mask all their bytes at once
+def _number(data):
+    return int(hexlify(data), 16)
+
+def _bytes(number):
+    return unhexlify('%0*x' % (2 * CHUNK_VOLUME, number))
+
+# block name -> block and block ID -> block, filled in as block types are defined; IDs
+# start at 1 (0 is air) and follow definition order, and saves refer to blocks by name
+BLOCK_TYPES = {}
+BLOCK_IDS = [None]
+
+def block_type(name):
+    return BLOCK_TYPES[name]
+
+def normalize(position):
+    x, y, z = position
+    x, y, z = (int(round(x)), int(round(y)), int(round(z)))
+    return (x, y, z)
+
+def sectorize(position):
+    x, y, z = normalize(position)
+    return (x // SECTOR_SIZE, y // SECTOR_SIZE, z // SECTOR_SIZE)
+
+def sector_origin(sector):
+    # the block position sector meshes are relative to
+    x, y, z = sector
+    return (x * SECTOR_SIZE, y * SECTOR_SIZE, z * SECTOR_SIZE)
+
+def chunk_key(position):
+    x, y, z = position
+    return (x >> CHUNK_BITS, y >> CHUNK_BITS, z >> CHUNK_BITS)
+
+def chunk_index(x, y, z):
+    return ((y & CHUNK_MASK) << (2 * CHUNK_BITS)) | ((z & CHUNK_MASK) << CHUNK_BITS) | (x & CHUNK_MASK)
+
+# (x, y, z) within its chunk of the block at each index
+CHUNK_OFFSETS = [(index & CHUNK_MASK, index >> (2 * CHUNK_BITS), (index >> CHUNK_BITS) & CHUNK_MASK)
+                 for index in range(CHUNK_VOLUME)]
+
+# (x, y, z) -> Block store; blocks are one-byte palette IDs in CHUNK_SIZE**3
+# arrays, ID 0 is air and chunks are dropped again once they empty out.
+# Alongside each chunk it can keep the exposed-face mask of every block: bit f is set
+# when the FACES[f] side of the block shows, i.e. the neighbour there is air or a block
+# of a different height. Masks are built per chunk on first use and then kept up to
+# date by set_id; bulk writes just drop the masks around them.
+class World(MutableMapping):
+    def __init__(self, palette=()):
+        self.palette = [None]
+        self.ids = {}
+        self.chunks = {}
+        self.counts = {}
+        self.faces = {}
+        # palette ID -> 1 + index of its block's height in heights, 0 for air
+        self.classes = bytearray(256)
+        self.heights = []
+        self.size = 0
+        self.dirty = set()
+        self.region = None
+        self.scratch = False
+        for block in palette:
+            self.register(block)
+
+    def __getstate__(self):
+        # face masks are left out of pickles and rebuilt on demand
+        state = self.__dict__.copy()
+        state['faces'] = {}
+        return state
+
+    def register(self, block):
+        if block in self.ids:
+            return self.ids[block]
+        if len(self.palette) > 255:
+            raise ValueError('World palette is full, cannot register %r' % block)
+        block_id = self.ids[block] = len(self.palette)
+        self.palette.append(block)
+        height = getattr(block, 'height', 0)
+        if height not in self.heights:
+            self.heights.append(height)
+        self.classes[block_id] = self.heights.index(height) + 1
+        return block_id
+
+    def get_id(self, x, y, z):
+        chunk = self.chunks.get((x >> CHUNK_BITS, y >> CHUNK_BITS, z >> CHUNK_BITS))
+        if chunk is None:
+            return 0
+        return chunk[((y & CHUNK_MASK) << (2 * CHUNK_BITS)) | ((z & CHUNK_MASK) << CHUNK_BITS) | (x & CHUNK_MASK)]
+
+    def set_id(self, x, y, z, block_id):
+        key = (x >> CHUNK_BITS, y >> CHUNK_BITS, z >> CHUNK_BITS)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            if not block_id:
+                return 0
+            chunk = self.chunks[key] = array('B', EMPTY_CHUNK)
+            self.counts[key] = 0
+        index = ((y & CHUNK_MASK) << (2 * CHUNK_BITS)) | ((z & CHUNK_MASK) << CHUNK_BITS) | (x & CHUNK_MASK)
+        old = chunk[index]
+        chunk[index] = block_id
+        self.dirty.add(key)
+        if old and not block_id:
+            self.size -= 1
+            self.counts[key] -= 1
+            if not self.counts[key]:
+                del self.chunks[key], self.counts[key]
+                self.faces.pop(key, None)
+        elif block_id and not old:
+            self.size += 1
+            self.counts[key] += 1
+        if self.faces and self.classes[old] != self.classes[block_id]:
+            self._update_faces(x, y, z, block_id)
+        return old
+
+    def _update_faces(self, x, y, z, block_id):
+        # the changed block's own mask and the facing bit of each of its neighbours
+        classes, chunks, all_faces = self.classes, self.chunks, self.faces
+        c = classes[block_id]
+        mask = 0
+        for face, (dx, dy, dz) in enumerate(FACES):
+            nx, ny, nz = x + dx, y + dy, z + dz
+            key = (nx >> CHUNK_BITS, ny >> CHUNK_BITS, nz >> CHUNK_BITS)
+            chunk = chunks.get(key)
+            if chunk is None:
+                mask |= FACE_BITS[face]
+                continue
+            index = ((ny & CHUNK_MASK) << (2 * CHUNK_BITS)) | ((nz & CHUNK_MASK) << CHUNK_BITS) | (nx & CHUNK_MASK)
+            n = classes[chunk[index]]
+            if n != c:
+                mask |= FACE_BITS[face]
+            faces = all_faces.get(key)
+            if faces is not None and n:
+                if n != c:
+                    faces[index] |= FACE_BITS[face ^ 1]
+                else:
+                    faces[index] &= ~FACE_BITS[face ^ 1]
+        faces = all_faces.get((x >> CHUNK_BITS, y >> CHUNK_BITS, z >> CHUNK_BITS))
+        if faces is not None:
+            faces[chunk_index(x, y, z)] = mask if c else 0
+
+    def _cell_faces(self, x, y, z, block_id):
+        classes, get_id = self.classes, self.get_id
+        c = classes[block_id]
+        if not c:
+            return 0
+        mask = 0
+        for face, (dx, dy, dz) in enumerate(FACES):
+            if classes[get_id(x + dx, y + dy, z + dz)] != c:
+                mask |= FACE_BITS[face]
+        return mask
+
+    def chunk_faces(self, key):
+        # the exposed-face masks of a chunk, built if need be; only call this from the
+        # thread that writes to the world
+        faces = self.faces.get(key)
+        if faces is None:
+            chunk = self.chunks.get(key)
+            if chunk is None:
+                return None
+            faces = self.faces[key] = self._build_faces(key, chunk)
+        return faces
+
+    def _chunk_classes(self, key):
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            return EMPTY_CHUNK
+        return chunk.tobytes().translate(bytes(self.classes))
+
+    def _build_faces(self, key, chunk):
+        # the height classes of the chunk next to those of its neighbour in each of FACES,
+        # shifted in from the six chunks around it, then compared a whole chunk at a time
+        cx, cy, cz = key
+        around = [self._chunk_classes((cx + dx, cy + dy, cz + dz)) for dx, dy, dz in FACES]
+        own = chunk.tobytes().translate(bytes(self.classes))
+        size, layer, volume = CHUNK_SIZE, STRIDE_Y, CHUNK_VOLUME
+        up = own[layer:] + around[0][:layer]
+        down = around[1][volume - layer:] + own[:volume - layer]
+        west = bytearray(b'\0' + own[:-1])
+        west[0::size] = around[2][size - 1::size]
+        east = bytearray(own[1:] + b'\0')
+        east[size - 1::size] = around[3][0::size]
+        south = bytearray(own[size:] + EMPTY_CHUNK[:size])
+        north = bytearray(EMPTY_CHUNK[:size] + own[:-size])
+        for y in range(0, volume, layer):
+            south[y + layer - size:y + layer] = around[4][y:y + size]
+            north[y:y + size] = around[5][y + layer - size:y + layer]
+        number = _number(own)
+        mask = 0
+        for face, neighbours in enumerate((up, down, west, east, south, north)):
+            mask |= _number(_bytes(number ^ _number(bytes(neighbours))).translate(FACE_TABLES[face]))
+        return array('B', _bytes(mask & _number(own.translate(SOLID_TABLE))))
+
+    def _drop_faces(self, key):
+        # after a bulk write to a chunk: its masks and the borders of its neighbours are stale
+        if self.faces:
+            cx, cy, cz = key
+            self.faces.pop(key, None)
+            for dx, dy, dz in FACES:
+                self.faces.pop((cx + dx, cy + dy, cz + dz), None)
+
+    def face_mask(self, x, y, z):
+        # exposed faces of the block at (x, y, z); safe to call from other threads, which
+        # work the mask out on the spot when the chunk has none built
+        faces = self.faces.get((x >> CHUNK_BITS, y >> CHUNK_BITS, z >> CHUNK_BITS))
+        if faces is not None:
+            return faces[chunk_index(x, y, z)]
+        return self._cell_faces(x, y, z, self.get_id(x, y, z))
+
+    def __contains__(self, position):
+        x, y, z = position
+        return self.get_id(x, y, z) != 0
+
+    def __getitem__(self, position):
+        x, y, z = position
+        block_id = self.get_id(x, y, z)
+        if not block_id:
+            raise KeyError(position)
+        return self.palette[block_id]
+
+    def get(self, position, default=None):
+        x, y, z = position
+        block_id = self.get_id(x, y, z)
+        if not block_id:
+            return default
+        return self.palette[block_id]
+
+    def __setitem__(self, position, block):
+        x, y, z = position
+        self.set_id(x, y, z, self.register(block))
+
+    def __delitem__(self, position):
+        x, y, z = position
+        if not self.set_id(x, y, z, 0):
+            raise KeyError(position)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for key in list(self.chunks):
+            for position in self.chunk_positions(key):
+                yield position
+
+    def chunk_positions(self, key):
+        # the positions of the blocks in a chunk, made on demand rather than stored
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            return []
+        cx, cy, cz = key
+        ox, oy, oz = cx << CHUNK_BITS, cy << CHUNK_BITS, cz << CHUNK_BITS
+        return [(ox + x, oy + y, oz + z) for (x, y, z), block_id in zip(CHUNK_OFFSETS, chunk) if block_id]
+
+    def columns(self):
+        # (cx, cz) -> sorted cy of the stored chunks in that sector column
+        columns = {}
+        for cx, cy, cz in self.chunks:
+            columns.setdefault((cx, cz), []).append(cy)
+        for cys in columns.values():
+            cys.sort()
+        return columns
+
+    def raycast(self, position, vector, max_distance=8):
+        # Amanatides-Woo grid traversal: visits every voxel the ray passes through, in order,
+        # and returns (hit block, the voxel before it, face normal of the hit) or Nones
+        x, y, z = position
+        ix, iy, iz = normalize(position)
+        if self.get_id(ix, iy, iz):
+            return (ix, iy, iz), None, None
+        cell = [ix, iy, iz]
+        step = [0, 0, 0]
+        t_max = [float('inf')] * 3
+        t_delta = [float('inf')] * 3
+        for axis, (p, d) in enumerate(zip(position, vector)):
+            if d > 0:
+                step[axis] = 1
+                t_max[axis] = (cell[axis] + 0.5 - p) / d
+                t_delta[axis] = 1.0 / d
+            elif d < 0:
+                step[axis] = -1
+                t_max[axis] = (cell[axis] - 0.5 - p) / d
+                t_delta[axis] = -1.0 / d
+        get_id = self.get_id
+        while True:
+            if t_max[0] <= t_max[1] and t_max[0] <= t_max[2]:
+                axis = 0
+            elif t_max[1] <= t_max[2]:
+                axis = 1
+            else:
+                axis = 2
+            if t_max[axis] > max_distance:
+                return None, None, None
+            previous = (cell[0], cell[1], cell[2])
+            cell[axis] += step[axis]
+            t_max[axis] += t_delta[axis]
+            if get_id(cell[0], cell[1], cell[2]):
+                normal = [0, 0, 0]
+                normal[axis] = -step[axis]
+                return (cell[0], cell[1], cell[2]), previous, tuple(normal)
+
+    # hooks for worlds backed by storage: fault() makes a sector column resident and returns
+    # the chunk keys it loaded, evict() drops clean columns outside keep and returns them
+    def fault(self, cx, cz):
+        return []
+
+    def evict(self, keep):
+        return []
+
+    def materialize(self):
+        # a World with every block in memory, for save formats that walk all of them
+        return self
+
+    def close(self):
+        pass
+
+    def unload_chunk(self, key):
+        if key in self.chunks:
+            self.size -= self.counts.pop(key)
+            del self.chunks[key]
+            self._drop_faces(key)
+
+    def load_chunk(self, key, data):
+        chunk = array('B', data)
+        count = CHUNK_VOLUME - chunk.count(0)
+        self.unload_chunk(key)
+        if count:
+            self.chunks[key] = chunk
+            self.counts[key] = count
+            self.size += count
+            self._drop_faces(key)
+
+    def fill_row(self, x0, x1, y, z, block):
+        # sets every block from (x0, y, z) to (x1, y, z) inclusive, one slice per chunk
+        block_id = self.register(block)
+        cy, cz = y >> CHUNK_BITS, z >> CHUNK_BITS
+        base = ((y & CHUNK_MASK) << (2 * CHUNK_BITS)) | ((z & CHUNK_MASK) << CHUNK_BITS)
+        row = array('B', [block_id]) * CHUNK_SIZE
+        x = x0
+        while x <= x1:
+            key = (x >> CHUNK_BITS, cy, cz)
+            end = min(x1, x | CHUNK_MASK)
+            chunk = self.chunks.get(key)
+            if chunk is None:
+                chunk = self.chunks[key] = array('B', EMPTY_CHUNK)
+                self.counts[key] = 0
+            i, j = base + (x & CHUNK_MASK), base + (end & CHUNK_MASK) + 1
+            added = chunk[i:j].count(0)
+            self.dirty.add(key)
+            self._drop_faces(key)
+            chunk[i:j] = row[:j - i]
+            self.counts[key] += added
+            self.size += added
+            x = end + 1
+
+    def exposed(self, position):
+        # whether any face of the block at position shows
+        x, y, z = position
+        faces = self.chunk_faces((x >> CHUNK_BITS, y >> CHUNK_BITS, z >> CHUNK_BITS))
+        return faces is not None and faces[chunk_index(x, y, z)] != 0
@@ -0,0 +1,216 @@
+from __future__ import division
+import math, os, random, shutil, tempfile
+from collections import OrderedDict
+from world import World, BLOCK_TYPES, CHUNK_SIZE
+from savers_and_loaders.region_format import MappedWorld, write
+
+SPAWN_RADIUS = 5
+
+def isqrt(n):
+    r = int(math.sqrt(n))
+    while r * r > n:
+        r -= 1
+    while (r + 1) * (r + 1) <= n:
+        r += 1
+    return r
+
+def disk_rows(s):
+    # x half-widths of each row of a hill layer: |dx|, |dz| <= s and dx**2 + dz**2 <= (s + 1)**2
+    if s < 0:
+        return []
+    r2 = (s + 1) ** 2
+    return [(dz, min(s, isqrt(r2 - dz * dz))) for dz in range(-s, s + 1)]
+
+def spawn_gap(z):
+    # x half-width of the spawn area kept clear of hills on row z (-1 if the row misses it)
+    r2 = SPAWN_RADIUS ** 2 - z * z
+    if r2 <= 0:
+        return -1
+    return isqrt(r2 - 1)
+
+def fill_row(world, x0, x1, y, z, block):
+    e = spawn_gap(z)
+    if e < 0 or x1 < -e or x0 > e:
+        world.fill_row(x0, x1, y, z, block)
+        return
+    if x0 < -e:
+        world.fill_row(x0, -e - 1, y, z, block)
+    if x1 > e:
+        world.fill_row(e + 1, x1, y, z, block)
+
+def generate_floor(world, size, floor, walls, progress=None):
+    n = size
+    for z in range(-n, n + 1):
+        world.fill_row(-n, n, -3, z, walls)
+        if z in (-n, n):
+            for y in range(-2, 3):
+                world.fill_row(-n, n, y, z, walls)
+        else:
+            world.fill_row(-n + 1, n - 1, -2, z, floor)
+            for y in range(-2, 3):
+                world.fill_row(-n, -n, y, z, walls)
+                world.fill_row(n, n, y, z, walls)
+        if progress:
+            progress()
+
+def generate_hill(world, a, b, c, h, s, block):
+    for y in range(c, c + h):
+        for dz, w in disk_rows(s):
+            fill_row(world, a - w, a + w, y, b + dz, block)
+        s -= 1
+
+def generate(world, size, floor, walls, hills, hill_blocks, progress=None):
+    generate_floor(world, size, floor, walls, progress)
+    o = size - 20
+    for _ in range(hills):
+        # same draw order as the original per-voxel loop, so a seed still maps to one world
+        a = random.randint(-o, o)
+        b = random.randint(-o, o)
+        c = -1
+        h = random.randint(16, 35)
+        s = random.randint(13, 29)
+        t = random.choice(hill_blocks)
+        generate_hill(world, a, b, c, h, s, t)
+        if progress:
+            progress()
+
+HILL_CELL = 64
+HILLS_PER_CELL = (4, 8)
+
+class SectorGenerator(object):
+    # terrain for one sector column at a time, decided only by the seed and the column:
+    # hills are scattered per HILL_CELL square, each cell with its own Random
+    def __init__(self, seed, floor, walls, hill_blocks):
+        self.seed = seed
+        self.floor = floor
+        self.walls = walls
+        self.hill_blocks = hill_blocks
+        self._hills = {}
+
+    def describe(self):
+        return {'seed': self.seed, 'floor': self.floor.name, 'walls': self.walls.name,
+                'hill_blocks': [block.name for block in self.hill_blocks]}
+
+    @classmethod
+    def from_description(cls, description):
+        return cls(description['seed'], BLOCK_TYPES[description['floor']], BLOCK_TYPES[description['walls']],
+                   [BLOCK_TYPES[name] for name in description['hill_blocks']])
+
+    def hills(self, gx, gz):
+        if (gx, gz) not in self._hills:
+            rng = random.Random('%i:%i:%i' % (self.seed, gx, gz))
+            hills = []
+            for _ in range(rng.randint(*HILLS_PER_CELL)):
+                a = gx * HILL_CELL + rng.randrange(HILL_CELL)
+                b = gz * HILL_CELL + rng.randrange(HILL_CELL)
+                h = rng.randint(16, 35)
+                s = rng.randint(13, 29)
+                t = rng.choice(self.hill_blocks)
+                hills.append((a, b, -1, h, s, t))
+            self._hills[(gx, gz)] = hills
+        return self._hills[(gx, gz)]
+
+    def prune(self, columns):
+        # forgets the hills of cells none of columns is generated from
+        cells = set()
+        for cx, cz in columns:
+            gx, gz = cx * CHUNK_SIZE // HILL_CELL, cz * CHUNK_SIZE // HILL_CELL
+            cells.update((gx + dx, gz + dz) for dx in (-1, 0, 1) for dz in (-1, 0, 1))
+        for cell in [cell for cell in self._hills if cell not in cells]:
+            del self._hills[cell]
+
+    def generate(self, world, cx, cz):
+        x0, z0 = cx * CHUNK_SIZE, cz * CHUNK_SIZE
+        x1, z1 = x0 + CHUNK_SIZE - 1, z0 + CHUNK_SIZE - 1
+        for z in range(z0, z1 + 1):
+            world.fill_row(x0, x1, -3, z, self.walls)
+            world.fill_row(x0, x1, -2, z, self.floor)
+        gx, gz = x0 // HILL_CELL, z0 // HILL_CELL
+        for hx in range(gx - 1, gx + 2):
+            for hz in range(gz - 1, gz + 2):
+                for a, b, c, h, s, t in self.hills(hx, hz):
+                    if a + s < x0 or a - s > x1 or b + s < z0 or b - s > z1:
+                        continue
+                    for y in range(c, c + h):
+                        for dz, w in disk_rows(s):
+                            z = b + dz
+                            if z0 <= z <= z1 and a + w >= x0 and a - w <= x1:
+                                fill_row(world, max(a - w, x0), min(a + w, x1), y, z, t)
+                        s -= 1
+
+class InfiniteWorld(MappedWorld):
+    # an unbounded world generated a sector column at a time as Model faults it in. The
+    # columns around the player that evict is told to keep always stay resident; capacity
+    # more are cached on top of those, least recently used first out, so the limit follows
+    # the view distance. Modified columns are spilled to a scratch region file of this
+    # world's own on the way out and read back from it later; close() deletes the file.
+    def __init__(self, generator, capacity=256, source=None):
+        # the scratch file starts empty, or as a copy of the region file source
+        handle, path = tempfile.mkstemp(prefix='scratch-', suffix='.region')
+        os.close(handle)
+        if source is None:
+            write(path, World([generator.floor, generator.walls] + generator.hill_blocks), {})
+        else:
+            shutil.copyfile(source, path)
+        MappedWorld.__init__(self, path)
+        self.generator = generator
+        self.capacity = capacity
+        self.recent = OrderedDict()
+        self.scratch = True
+
+    @classmethod
+    def from_save(cls, path, description, capacity=256):
+        return cls(SectorGenerator.from_description(description), capacity, path)
+
+    def close(self):
+        MappedWorld.close(self)
+        for path in (self.region, self.region + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def save_parts(self):
+        return {'generator': self.generator.describe()}
+
+    def fault(self, cx, cz):
+        column = (cx, cz)
+        if column in self.resident:
+            self.recent.pop(column, None)
+            self.recent[column] = True
+            return []
+        if column in self.table:
+            keys = MappedWorld.fault(self, cx, cz)
+        else:
+            self.resident.add(column)
+            # generated chunks can always be generated again, so they don't count as dirty
+            dirty, self.dirty = self.dirty, set()
+            self.generator.generate(self, cx, cz)
+            keys, self.dirty = [key for key in self.dirty if key in self.chunks], dirty
+        self.recent[column] = True
+        return keys
+
+    def evict(self, keep):
+        limit = len(keep) + self.capacity
+        if len(self.resident) <= limit:
+            return []
+        victims = []
+        for column in self.recent:
+            if len(self.resident) - len(victims) <= limit:
+                break
+            if column not in keep:
+                victims.append(column)
+        if set((cx, cz) for cx, cy, cz in self.dirty) & set(victims):
+            write(self.region, self, {})
+        columns = self.columns()
+        for column in victims:
+            cx, cz = column
+            for cy in columns.get(column, ()):
+                self.unload_chunk((cx, cy, cz))
+            self.resident.discard(column)
+            del self.recent[column]
+        if victims:
+            self.generator.prune(self.resident)
+        return victims
+
+    def __bool__(self):
+        return True
+    __nonzero__ = __bool__